@@ -2,6 +2,6 @@
 
 #__all__ = ['root_agent']
 
-from .gmailassistant import main
+from .gmailassistant import main, shutdown, AgentHost, get_host
 
-__all__ = ['main']
\ No newline at end of file
+__all__ = ['main', 'shutdown', 'AgentHost', 'get_host']
\ No newline at end of file
@@ -1,80 +1,429 @@
 import asyncio
+import time
 from google.adk.agents import LlmAgent
 from google.adk.tools.mcp_tool.mcp_toolset import MCPToolset, StdioServerParameters
-from google.adk.sessions import InMemorySessionService
+from google.adk.sessions import InMemorySessionService, DatabaseSessionService
 from google.adk.runners import Runner
 from google.genai import types
 import warnings
 warnings.filterwarnings("ignore")
 import os
+import sys
 
 from dotenv import load_dotenv
 
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not __package__:
+    # Run as a script (python agent/gmailassistant.py): sys.path[0] is agent/
+    sys.path.insert(0, BASE_DIR)
+
+from google_tools.utils import metrics
+
 load_dotenv()
 
 APP_NAME = "basic_agent_no_web"
 USER_ID = "user_12345"
 SESSION_ID = "session_12345"
 
-async def main():
-    toolset = None
+SERVER_PATH = os.path.join(BASE_DIR, "google_tools", "server.py")
+
+# Ping the MCP server before a run if it has been idle this long
+HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("MCP_HEALTH_CHECK_TIMEOUT", "5"))
+
+# Session storage: "memory" or any SQLAlchemy URL (google-adk[database]).
+# One session per Gmail thread/message keeps concurrent emails apart.
+SESSION_DB_URL = os.getenv("SESSION_DB_URL", f"sqlite:///{os.path.join(BASE_DIR, 'agent_sessions.sqlite3')}")
+# Sessions untouched for this long are deleted
+SESSION_RETENTION_SECONDS = float(os.getenv("SESSION_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# A session with more events than this is compacted: history is dropped, state is kept
+SESSION_MAX_EVENTS = int(os.getenv("SESSION_MAX_EVENTS", "200"))
+# How often the retention sweep runs
+SESSION_PRUNE_INTERVAL = float(os.getenv("SESSION_PRUNE_INTERVAL", "3600"))
+
+_runs = metrics.counter("agent_runs_total", "Agent runs by outcome (ok, error)")
+_run_seconds = metrics.histogram("agent_run_seconds", "Wall time of one Runner.run_async call")
+_llm_tokens = metrics.counter("llm_tokens_total", "LLM tokens by kind (prompt, completion, total)")
+_llm_responses = metrics.counter("llm_responses_total", "Model responses received during agent runs")
+_agent_tool_calls = metrics.counter("agent_tool_calls_total", "Tool calls made by the agent")
+_agent_tool_seconds = metrics.histogram(
+    "agent_tool_seconds", "Tool latency seen by the agent (MCP round trip included)"
+)
+
+
+async def _close_toolset(toolset):
+    """Cleanly close an MCP server connection (the method name differs across ADK versions)."""
     try:
-        # create memory session 
-        session_service = InMemorySessionService()
-        session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        SERVER_PATH = os.path.join(BASE_DIR, "google_tools", "server.py")
+        # Try different close methods
+        if hasattr(toolset, 'cleanup'):
+            await toolset.cleanup()
+        elif hasattr(toolset, '_exit'):
+            await toolset._exit()
+        elif hasattr(toolset, '__aexit__'):
+            await toolset.__aexit__(None, None, None)
+        elif hasattr(toolset, 'close'):
+            await toolset.close()
+        print("✅ MCP connection closed successfully")
+    except Exception as e:
+        print(f"⚠️ Error closing MCP connection (can be ignored): {e}")
+
+
+def _make_session_service():
+    if SESSION_DB_URL == "memory":
+        return InMemorySessionService()
+    return DatabaseSessionService(db_url=SESSION_DB_URL)
+
+
+class _RunTrace:
+    """
+    Metrics for one Runner.run_async call, collected from its event stream.
+
+    Tool latency is the time between the event carrying a function call and
+    the one carrying its response; token counts come from the usage metadata
+    of model responses (when the ADK version reports it).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.tokens = {"prompt": 0, "completion": 0, "total": 0}
+        self.tool_calls: list[dict] = []
+        self._pending: dict[str, tuple[str, float]] = {}
+
+    def record(self, event) -> None:
+        now = time.perf_counter()
+        for call in event.get_function_calls():
+            self._pending[call.id or call.name] = (call.name, now)
+        for response in event.get_function_responses():
+            name, started = self._pending.pop(response.id or response.name, (response.name, None))
+            seconds = now - started if started is not None else None
+            _agent_tool_calls.inc(tool=name)
+            if seconds is not None:
+                _agent_tool_seconds.observe(seconds, tool=name)
+            self.tool_calls.append({"tool": name, "seconds": round(seconds, 4) if seconds is not None else None})
+            metrics.log_event("agent_tool_call", tool=name, seconds=seconds)
+
+        usage = getattr(event, "usage_metadata", None)
+        if usage is not None:
+            _llm_responses.inc()
+            for kind, field in (("prompt", "prompt_token_count"),
+                                ("completion", "candidates_token_count"),
+                                ("total", "total_token_count")):
+                count = getattr(usage, field, None) or 0
+                self.tokens[kind] += count
+                _llm_tokens.inc(count, kind=kind)
+
+    def finish(self, session_id: str, outcome: str, error: str | None = None) -> None:
+        seconds = time.perf_counter() - self.start
+        _runs.inc(outcome=outcome)
+        _run_seconds.observe(seconds)
+        metrics.log_event(
+            "agent_run", session_id=session_id, outcome=outcome, error=error,
+            seconds=round(seconds, 3), tokens=self.tokens, tool_calls=self.tool_calls,
+        )
+
+
+def _tag_tool_calls(tool):
+    """
+    Make `tool` send the email's correlation ID along with every call.
+
+    The ID goes into a copy of the arguments: the original dict is the
+    function call stored in the session, which the model sees again on
+    later turns.
+    """
+    run_async = tool.run_async
+
+    async def tagged_run_async(*, args, tool_context):
+        correlation_id = metrics.current_correlation_id()
+        if correlation_id:
+            args = {**args, metrics.CORRELATION_ARG: correlation_id}
+        return await run_async(args=args, tool_context=tool_context)
+
+    tool.run_async = tagged_run_async
+    return tool
+
+
+class AgentHost:
+    """
+    Keeps the MCP tool server, agent and runner warm across many prompts.
+
+    The `google_tools/server.py` subprocess is spawned once and reused, so a
+    prompt no longer pays for interpreter startup, tool-server imports and
+    the MCP handshake. The server is pinged before a run when it has been
+    idle for a while and is restarted if the ping fails or a run errors.
+
+    The MCP stdio client must be opened and closed by the same task, so the
+    toolset is owned by one long-lived task (_own_toolset); restarts and
+    shutdown ask that task to close it. A restart waits until no run is
+    using the toolset; new runs queue behind it meanwhile.
+
+    Each run gets its own session, keyed by Gmail thread or message ID, so
+    concurrent emails never share conversation history. Old sessions are
+    swept after SESSION_RETENTION_SECONDS and oversized ones compacted.
+
+    All methods must be awaited on the same event loop.
+    """
+
+    def __init__(self):
+        self.toolset = None
+        self.runner = None
+        # Created once so sessions survive tool-server restarts
+        self.session_service = _make_session_service()
+        self.restarts = 0
+        self._last_ok = 0.0
+        self._last_prune = 0.0
+        self._lock = asyncio.Lock()
+        self._session_lock = asyncio.Lock()
+        # Owner task of the current toolset and the event that tells it to close
+        self._owner: asyncio.Task | None = None
+        self._close_requested: asyncio.Event | None = None
+        # Runs currently using the toolset; restarts wait for this to reach 0
+        self._active_runs = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._needs_restart = False
+
+    async def _start(self):
         # 1. Setup MCP toolset
-        toolset = MCPToolset(
+        self.toolset = MCPToolset(
             connection_params=StdioServerParameters(
                 command="python",
                 args=[SERVER_PATH]
             )
         )
-        await toolset._initialize()
-        tool_set = await toolset.load_tools()
+        await self.toolset._initialize()
+        tool_set = await self.toolset.load_tools()
 
         # 2. Create agent
         root_agent = LlmAgent(
-    name="gmailassistant",
-    description="Automated Gmail assistant that reads and responds to emails",
-    instruction=os.getenv("AGENT_INSTRUCTION"),
-    model="gemini-2.0-flash-exp",
-    tools=tool_set
-)
+            name="gmailassistant",
+            description="Automated Gmail assistant that reads and responds to emails",
+            instruction=os.getenv("AGENT_INSTRUCTION"),
+            model="gemini-2.0-flash-exp",
+            tools=[_tag_tool_calls(tool) for tool in tool_set],
+        )
 
         # 3. Create runner instance
-        runner = Runner(app_name=APP_NAME, agent=root_agent, session_service=session_service)
+        self.runner = Runner(app_name=APP_NAME, agent=root_agent, session_service=self.session_service)
+        self._last_ok = time.monotonic()
+        print("🔌 MCP tool server started")
 
-        automated_prompt = os.getenv("automated_prompt")
-        content = types.Content(role="user", parts=[types.Part(text=automated_prompt)])
-        print("🤖 Agent is processing the latest email...\n")
+    async def _own_toolset(self, ready: asyncio.Future):
+        """Open the toolset, keep it until asked to close, then close it, all in this task."""
+        try:
+            await self._start()
+        except BaseException as e:
+            await self._stop()
+            if not ready.done():
+                ready.set_exception(e)
+            return
+        ready.set_result(None)
+        try:
+            await self._close_requested.wait()
+        finally:
+            await self._stop()
 
-        events = runner.run_async(
-            new_message=content,
-            user_id=USER_ID,
-            session_id=SESSION_ID,
+    async def _open(self):
+        """Start a new owner task and wait until its toolset is ready."""
+        ready = asyncio.get_running_loop().create_future()
+        self._close_requested = asyncio.Event()
+        self._owner = asyncio.create_task(self._own_toolset(ready), name="mcp-toolset-owner")
+        await ready
+
+    async def _close(self):
+        """Ask the owner task to close the toolset and wait for it. Call with no runs active."""
+        if self._owner is not None:
+            self._close_requested.set()
+            try:
+                await self._owner
+            except Exception as e:
+                print(f"⚠️ Error closing MCP connection: {e}")
+        self._owner = None
+        self._close_requested = None
+
+    async def _stop(self):
+        if self.toolset is not None:
+            await _close_toolset(self.toolset)
+        self.toolset = None
+        self.runner = None
+
+    async def _restart_locked(self):
+        # Let in-flight runs finish with the old server before replacing it
+        await self._idle.wait()
+        await self._close()
+        self.restarts += 1
+        self._needs_restart = False
+        await self._open()
+
+    async def restart(self):
+        async with self._lock:
+            await self._restart_locked()
+
+    async def health_check(self) -> bool:
+        """Ping the MCP server; True if it answered in time."""
+        session = getattr(self.toolset, "session", None)
+        if session is None:
+            return False
+        try:
+            await asyncio.wait_for(session.send_ping(), timeout=HEALTH_CHECK_TIMEOUT)
+        except Exception as e:
+            print(f"⚠️ MCP health check failed: {e}")
+            return False
+        self._last_ok = time.monotonic()
+        return True
+
+    async def _acquire(self):
+        """Make sure the tool server is up and register a run using it."""
+        async with self._lock:
+            if self.runner is None:
+                await self._open()
+            elif self._needs_restart:
+                print("🔁 Restarting MCP tool server after a failed run")
+                await self._restart_locked()
+            elif time.monotonic() - self._last_ok >= HEALTH_CHECK_INTERVAL and not await self.health_check():
+                print("🔁 Restarting MCP tool server")
+                await self._restart_locked()
+            # Registered before the lock is released, so a restart queued
+            # behind us waits for this run
+            self._active_runs += 1
+            self._idle.clear()
+
+    def _release(self):
+        self._active_runs -= 1
+        if self._active_runs == 0:
+            self._idle.set()
+
+    async def ensure_started(self):
+        await self._acquire()
+        self._release()
+
+    async def _prune_sessions(self):
+        """Delete sessions that have not been updated within the retention window."""
+        now = time.time()
+        if now - self._last_prune < SESSION_PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        async with self._session_lock:
+            await asyncio.to_thread(self._delete_sessions_before, now - SESSION_RETENTION_SECONDS)
+
+    def _delete_sessions_before(self, cutoff: float):
+        response = self.session_service.list_sessions(app_name=APP_NAME, user_id=USER_ID)
+        for session in response.sessions:
+            if session.last_update_time < cutoff:
+                self.session_service.delete_session(
+                    app_name=APP_NAME, user_id=USER_ID, session_id=session.id
+                )
+
+    def _get_session(self, session_id: str):
+        """Return the session for `session_id`, creating or compacting it as needed."""
+        session = self.session_service.get_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=session_id
         )
+        if session is not None and len(session.events) > SESSION_MAX_EVENTS:
+            # Compact: keep the state, drop the event history
+            state = dict(session.state)
+            self.session_service.delete_session(
+                app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+            )
+            session = self.session_service.create_session(
+                app_name=APP_NAME, user_id=USER_ID, state=state, session_id=session_id
+            )
+        if session is None:
+            session = self.session_service.create_session(
+                app_name=APP_NAME, user_id=USER_ID, session_id=session_id
+            )
+        return session
+
+    async def run(self, prompt: str, session_key: str | None = None) -> str | None:
+        """
+        Run one prompt against the warm agent and return its final response text.
 
-        async for event in events:
-            if event.is_final_response():
-                print("Agent:", event.content.parts[0].text)
+        `session_key` (a Gmail thread or message ID) selects the session; runs
+        with the same key continue the same conversation.
+        """
+        await self._acquire()
+        try:
+            return await self._run(prompt, session_key)
+        finally:
+            self._release()
 
+    async def _run(self, prompt: str, session_key: str | None) -> str | None:
+        session_id = f"email-{session_key}" if session_key else SESSION_ID
+        await self._prune_sessions()
+        # The session service is blocking (SQL); keep it off the event loop.
+        # One call at a time, so two runs of one thread can't both create it.
+        async with self._session_lock:
+            await asyncio.to_thread(self._get_session, session_id)
+
+        content = types.Content(role="user", parts=[types.Part(text=prompt)])
+        final_text = None
+        trace = _RunTrace()
+        metrics.log_event("agent_run_started", session_id=session_id)
+        try:
+            events = self.runner.run_async(
+                new_message=content,
+                user_id=USER_ID,
+                session_id=session_id,
+            )
+            async for event in events:
+                trace.record(event)
+                if event.is_final_response():
+                    final_text = event.content.parts[0].text
+                    print("Agent:", final_text)
+        except Exception as e:
+            trace.finish(session_id, "error", error=str(e))
+            # The tool server may have died mid-run. Other runs may still be
+            # using it, so don't restart here; the next run restarts it once
+            # they are done.
+            if not await self.health_check():
+                self._needs_restart = True
+            raise
+        trace.finish(session_id, "ok")
+        self._last_ok = time.monotonic()
+        return final_text
+
+    async def shutdown(self):
+        async with self._lock:
+            await self._idle.wait()
+            await self._close()
+
+
+_host: AgentHost | None = None
+
+def get_host() -> AgentHost:
+    """Return the process-wide agent host (started lazily on first run)."""
+    global _host
+    if _host is None:
+        _host = AgentHost()
+        metrics.register_collector("agent_host", lambda: {"restarts": _host.restarts})
+    return _host
+
+
+async def shutdown():
+    """Stop the shared MCP tool server, if one was started."""
+    if _host is not None:
+        await _host.shutdown()
+
+
+async def main(message_id: str | None = None, thread_id: str | None = None):
+    automated_prompt = os.getenv("automated_prompt")
+    if message_id:
+        # Point the agent at one specific email instead of "the latest"
+        automated_prompt = (
+            f"{automated_prompt}\n\nProcess the email with Gmail message ID "
+            f"{message_id} (use read_email_tool to read it)."
+        )
+    print("🤖 Agent is processing the latest email...\n")
+    # Replies within one Gmail thread share a session; everything else is isolated
+    return await get_host().run(automated_prompt, session_key=thread_id or message_id)
+
+
+async def _run_once():
+    try:
+        await main()
     finally:
         # ✅ Cleanly close MCP server connection
-        if toolset is not None:
-            try:
-                # Try different close methods
-                if hasattr(toolset, 'cleanup'):
-                    await toolset.cleanup()
-                elif hasattr(toolset, '__aexit__'):
-                    await toolset.__aexit__(None, None, None)
-                elif hasattr(toolset, 'close'):
-                    await toolset.close()
-                print("✅ MCP connection closed successfully")
-            except Exception as e:
-                print(f"⚠️ Error closing MCP connection (can be ignored): {e}")
+        await shutdown()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(_run_once())
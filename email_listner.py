@@ -9,30 +9,176 @@ import json
 import asyncio
 import threading
 import time
+from collections import OrderedDict
 from google.cloud import pubsub_v1
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 # Import the agent
-from agent.gmailassistant import main as agent_main
+from agent.gmailassistant import main as agent_main, shutdown as agent_shutdown
+from google_tools.gmail.store import MessageStore, fetch_history_delta
+from google_tools.utils import metrics
 
 # Configuration
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
 SUBSCRIPTION_ID = os.getenv("SUBSCRIPTION_ID")
 TOKEN_PATH = os.getenv("TOKEN_PATH")
 
+# Last Gmail historyId whose changes were turned into agent runs
+HISTORY_CHECKPOINT_PATH = os.getenv("HISTORY_CHECKPOINT_PATH", ".history_checkpoint")
+
+# Agent execution pool: how many agent runs may execute at once. Pub/Sub
+# flow control is sized from this so we never lease far more notifications
+# than we can work through.
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "4"))
+PUBSUB_MAX_OUTSTANDING = int(os.getenv("PUBSUB_MAX_OUTSTANDING", str(AGENT_MAX_CONCURRENCY * 2)))
+# Deliveries of one notification whose agent runs failed before we give up on them
+AGENT_MAX_ATTEMPTS = int(os.getenv("AGENT_MAX_ATTEMPTS", "3"))
+
 # Deduplication: Track processed message IDs (not history IDs!)
-processed_messages = set()
-message_lock = threading.Lock()
-MAX_CACHE_SIZE = 100
+MAX_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "10000"))
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", str(7 * 24 * 3600)))
+DEDUP_CACHE_PATH = os.getenv("DEDUP_CACHE_PATH", ".dedup_cache.json")
+
+# Prometheus endpoint for this process (0 = off; METRICS_DIR enables the file exporter)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+_notifications = metrics.counter(
+    "pubsub_notifications_total", "Pub/Sub notifications by outcome (duplicate, no_new, dispatched, error)"
+)
+_delivery_lag = metrics.histogram("pubsub_delivery_lag_seconds", "Time from Pub/Sub publish to our callback")
+_queue_wait = metrics.histogram("agent_queue_wait_seconds", "Time an email waited for a free agent slot")
+_email_seconds = metrics.histogram("email_processing_seconds", "Time from agent slot to finished agent run, per email")
+
+
+class DedupCache:
+    """
+    Ordered, size- and time-bounded set of already-seen keys.
+
+    Entries are kept in insertion order with their timestamp, so eviction
+    always drops the oldest key (never the one just added) and lookups stay
+    O(1). When `path` is set, each change is appended as one line to a
+    journal next to it (`<path>.log`), and the snapshot at `path` is only
+    rewritten when the journal has grown past the live entry count. Both
+    are reloaded on start, so dedup survives restarts.
+    """
+
+    def __init__(self, max_size: int = MAX_CACHE_SIZE, ttl: float = DEDUP_TTL_SECONDS, path: str | None = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.journal_path = path + ".log" if path else None
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, float] = OrderedDict()
+        self._journal_lines = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _expire(self, now: float) -> None:
+        # Oldest entries come first, so stop at the first one still valid
+        while self._entries:
+            key, seen_at = next(iter(self._entries.items()))
+            if now - seen_at <= self.ttl and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+
+    def add_if_new(self, key: str) -> bool:
+        """Record `key`; return True if it was not seen before (caller should process it)."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._entries[key] = now
+            self._expire(now)
+            self._append({"k": key, "t": now})
+            return True
+
+    def discard(self, key: str) -> None:
+        """Forget `key`, e.g. when processing failed and a retry should go through."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._append({"k": key, "d": 1})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _load(self) -> None:
+        if not self.path:
+            return
+        try:
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    entries = json.load(f)
+                for key, seen_at in sorted(entries.items(), key=lambda kv: kv[1]):
+                    self._entries[key] = seen_at
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path) as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # torn last line after a crash
+                        if record.get("d"):
+                            self._entries.pop(record["k"], None)
+                        else:
+                            self._entries.pop(record["k"], None)
+                            self._entries[record["k"]] = record["t"]
+                        self._journal_lines += 1
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load dedup cache ({e}), starting empty")
+            self._entries.clear()
+            return
+        self._expire(time.time())
+
+    def _append(self, record: dict) -> None:
+        if not self.path:
+            return
+        try:
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self._journal_lines += 1
+            # Compact once the journal outgrows what it describes
+            if self._journal_lines > max(1000, len(self._entries)):
+                self._compact()
+        except OSError as e:
+            print(f"⚠️ Could not persist dedup cache: {e}")
+
+    def _compact(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)  # atomic, never leaves a half-written file
+        # The snapshot now covers everything in the journal
+        open(self.journal_path, "w").close()
+        self._journal_lines = 0
+
+
+# Keys are prefixed so Gmail and Pub/Sub IDs can share one cache
+processed_messages = DedupCache(path=DEDUP_CACHE_PATH)
+
+# Shared with the MCP tool server: recording the notified historyId lets the
+# tools serve reads from the local store without asking Gmail again.
+message_store = MessageStore()
+
+# Gmail service (built once; the client refreshes its own token)
+_gmail_service = None
+_gmail_service_lock = threading.Lock()
 
-# Gmail service
 def get_gmail_service():
-    creds = Credentials.from_authorized_user_file(TOKEN_PATH)
-    return build("gmail", "v1", credentials=creds)
+    global _gmail_service
+    with _gmail_service_lock:
+        if _gmail_service is None:
+            creds = Credentials.from_authorized_user_file(TOKEN_PATH)
+            _gmail_service = build("gmail", "v1", credentials=creds, static_discovery=True)
+        return _gmail_service
 
-def get_latest_message_id():
-    """Get the ID of the most recent email"""
+def get_latest_message():
+    """Get (message ID, thread ID) of the most recent email"""
     try:
         service = get_gmail_service()
         results = service.users().messages().list(
@@ -43,76 +189,274 @@ def get_latest_message_id():
         
         messages = results.get('messages', [])
         if messages:
-            return messages[0]['id']
+            return messages[0]['id'], messages[0].get('threadId')
         return None
     except Exception as e:
         print(f"Error getting message ID: {e}")
         return None
 
-def run_agent_in_background(message_id):
-    """Run the agent in a new event loop in a background thread"""
+# History checkpoint
+history_lock = threading.Lock()
+
+def load_history_checkpoint():
     try:
-        print(f"🤖 Starting agent for message ID: {message_id}...")
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(agent_main())
-        loop.close()
-        print("✅ Agent completed\n")
-    except Exception as e:
-        print(f"❌ Agent error: {e}\n")
+        with open(HISTORY_CHECKPOINT_PATH) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def save_history_checkpoint(history_id):
+    tmp_path = HISTORY_CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(history_id))
+    os.replace(tmp_path, HISTORY_CHECKPOINT_PATH)
+
+def get_new_messages(history_id):
+    """
+    Resolve a notification into the inbox messages added since the last checkpoint.
+
+    Returns [(message_id, thread_id), ...]; the thread ID keys the agent
+    session, so replies within one Gmail thread share a conversation.
+
+    Uses the Gmail History API from the persisted checkpoint, so every email
+    in a burst is returned exactly once (in arrival order) instead of only
+    the newest one. Without a usable checkpoint (first run, or Gmail expired
+    it) this falls back to the latest inbox message.
+    """
+    history_id = int(history_id) if history_id else None
+
+    with history_lock:
+        checkpoint = load_history_checkpoint()
+        new_messages = None
+
+        if checkpoint is not None and history_id is not None:
+            if history_id <= checkpoint:
+                return []  # already covered by an earlier delta
+            try:
+                delta = fetch_history_delta(get_gmail_service(), checkpoint, label_id="INBOX")
+                new_messages = [
+                    (msg_id, delta["threads"].get(msg_id)) for msg_id in delta["added"]
+                    if "INBOX" in delta["labels"].get(msg_id, ["INBOX"])
+                    and "SENT" not in delta["labels"].get(msg_id, [])
+                ]
+                history_id = max(history_id, delta["history_id"])
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                print("⚠️ History checkpoint expired, falling back to latest message")
+
+        if new_messages is None:
+            latest = get_latest_message()
+            new_messages = [latest] if latest else []
+
+        if history_id is not None:
+            save_history_checkpoint(history_id)
+        return new_messages
+
+class AgentPool:
+    """
+    Runs agent invocations on one long-lived asyncio loop with bounded concurrency.
+
+    The loop lives in its own daemon thread; Pub/Sub callbacks hand work to it
+    with submit(), which returns a concurrent.futures.Future. At most
+    `max_concurrency` agents run at the same time, the rest wait on the
+    semaphore and show up as "queued" in stats().
+    """
+
+    def __init__(self, max_concurrency: int = AGENT_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._thread = threading.Thread(target=self._run_loop, name="agent-pool", daemon=True)
+        self._stats_lock = threading.Lock()
+        self._stats = {"queued": 0, "in_flight": 0, "completed": 0, "failed": 0}
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        # Shut the shared MCP tool server down on the loop that owns it
+        try:
+            asyncio.run_coroutine_threadsafe(agent_shutdown(), self.loop).result(timeout=10)
+        except Exception as e:
+            print(f"⚠️ Error shutting down agent host: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+    def _bump(self, **deltas):
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {"max_concurrency": self.max_concurrency, **self._stats}
+
+    async def _run(self, message_id, thread_id=None, correlation_id=None) -> bool:
+        """Run the agent for one email; True if it completed."""
+        # Everything this email triggers (agent run, tool calls) logs under one ID
+        with metrics.correlation(correlation_id):
+            self._bump(queued=1)
+            submitted = time.perf_counter()
+            async with self._semaphore:
+                started = time.perf_counter()
+                _queue_wait.observe(started - submitted)
+                self._bump(queued=-1, in_flight=1)
+                outcome = "ok"
+                try:
+                    print(f"🤖 Starting agent for message ID: {message_id}...")
+                    await agent_main(message_id=message_id, thread_id=thread_id)
+                    self._bump(completed=1)
+                    print("✅ Agent completed\n")
+                except Exception as e:
+                    outcome = "error"
+                    self._bump(failed=1)
+                    print(f"❌ Agent error: {e}\n")
+                finally:
+                    self._bump(in_flight=-1)
+                    seconds = time.perf_counter() - started
+                    _email_seconds.observe(seconds)
+                    metrics.log_event(
+                        "email_processed", message_id=message_id, outcome=outcome,
+                        seconds=round(seconds, 3), queue_seconds=round(started - submitted, 3),
+                    )
+                return outcome == "ok"
+
+    def submit(self, message_id, thread_id=None, correlation_id=None):
+        return asyncio.run_coroutine_threadsafe(self._run(message_id, thread_id, correlation_id), self.loop)
+
+
+agent_pool = AgentPool()
+
+# Pub/Sub message ID -> ((message ID, thread ID) of emails whose agent run
+# failed, attempts so far). The history checkpoint has already moved past
+# these emails, so a redelivered notification retries exactly these instead
+# of asking Gmail.
+_failed_runs: dict[str, tuple[list[tuple[str, str | None]], int]] = {}
+_failed_runs_lock = threading.Lock()
+
+def ack_when_done(message, futures):
+    """
+    Settle the Pub/Sub message once all agent runs it triggered have finished.
+
+    `futures` maps (message ID, thread ID) pairs to AgentPool.submit() futures. If every
+    run succeeded the notification is acked. Otherwise the failed emails'
+    dedup keys are dropped and the notification is nacked, so Pub/Sub
+    redelivers it and those emails are retried, up to AGENT_MAX_ATTEMPTS.
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(_future):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if not finished:
+            return
+        failed = [
+            email for email, future in futures.items()
+            if future.cancelled() or future.exception() is not None or not future.result()
+        ]
+        with _failed_runs_lock:
+            attempts = _failed_runs.pop(message.message_id, ([], 0))[1] + 1
+            if failed and attempts < AGENT_MAX_ATTEMPTS:
+                _failed_runs[message.message_id] = (failed, attempts)
+        if not failed:
+            message.ack()
+        elif attempts >= AGENT_MAX_ATTEMPTS:
+            failed_ids = [msg_id for msg_id, _thread_id in failed]
+            print(f"❌ Giving up on message IDs {failed_ids} after {attempts} attempts")
+            metrics.log_event("email_abandoned", message_ids=failed_ids, attempts=attempts)
+            message.ack()
+        else:
+            for msg_id, _thread_id in failed:
+                processed_messages.discard(f"gmail:{msg_id}")
+            processed_messages.discard(f"pubsub:{message.message_id}")
+            message.nack()
+
+    for future in futures.values():
+        future.add_done_callback(_done)
 
 # Process incoming email notification
 def process_notification(message):
     try:
+        # Pub/Sub redelivers on slow acks; drop repeats before any Gmail calls
+        if not processed_messages.add_if_new(f"pubsub:{message.message_id}"):
+            print(f"⏭️  Skipping - already handled Pub/Sub message: {message.message_id}")
+            _notifications.inc(outcome="duplicate")
+            message.ack()
+            return
+        if message.publish_time is not None:
+            _delivery_lag.observe(max(0.0, time.time() - message.publish_time.timestamp()))
+
         # Decode Pub/Sub message
         data = json.loads(message.data.decode('utf-8'))
         email_address = data.get('emailAddress')
         history_id = data.get('historyId')
+        if history_id:
+            message_store.record_notification(history_id)
         
-        # Get the actual message ID of the latest email
-        latest_message_id = get_latest_message_id()
+        with _failed_runs_lock:
+            retry = _failed_runs.get(message.message_id)
+        if retry is not None:
+            # Redelivery after failed agent runs: retry just those emails
+            new_messages = retry[0]
+        else:
+            # Resolve exactly which emails arrived since we last looked
+            new_messages = get_new_messages(history_id)
         
-        if not latest_message_id:
-            print("⚠️ No message found in inbox")
+        if not new_messages:
+            print("⚠️ No new message in inbox")
+            _notifications.inc(outcome="no_new")
             message.ack()
             return
         
-        # Check if we've already processed this message
-        with message_lock:
-            if latest_message_id in processed_messages:
-                print(f"⏭️  Skipping - already processed message ID: {latest_message_id}")
-                message.ack()
-                return
+        futures = {}
+        for message_id, thread_id in new_messages:
+            # Check if we've already processed this message
+            if not processed_messages.add_if_new(f"gmail:{message_id}"):
+                print(f"⏭️  Skipping - already processed message ID: {message_id}")
+                print(f"   Dedup stats: {processed_messages.stats()}")
+                continue
             
-            # Add to processed set
-            processed_messages.add(latest_message_id)
+            # Print notification
+            print("\n" + "="*60)
+            print("📧 NEW EMAIL RECEIVED!")
+            print("="*60)
+            print(f"Account: {email_address}")
+            print(f"History ID: {history_id}")
+            print(f"Message ID: {message_id}")
+            print("="*60 + "\n")
             
-            # Keep cache size limited
-            if len(processed_messages) > MAX_CACHE_SIZE:
-                processed_messages.pop()
+            correlation_id = metrics.new_correlation_id()
+            metrics.log_event(
+                "email_received", correlation_id=correlation_id, message_id=message_id,
+                history_id=history_id, pubsub_message_id=message.message_id,
+            )
+            # Hand off to the bounded agent pool
+            futures[(message_id, thread_id)] = agent_pool.submit(message_id, thread_id, correlation_id)
         
-        # Print notification
-        print("\n" + "="*60)
-        print("📧 NEW EMAIL RECEIVED!")
-        print("="*60)
-        print(f"Account: {email_address}")
-        print(f"History ID: {history_id}")
-        print(f"Message ID: {latest_message_id}")
-        print("="*60 + "\n")
+        print(f"📊 Agent pool: {agent_pool.stats()}")
+        _notifications.inc(outcome="dispatched" if futures else "duplicate")
         
-        # Start agent in a background thread
-        agent_thread = threading.Thread(
-            target=run_agent_in_background, 
-            args=(latest_message_id,),
-            daemon=True
-        )
-        agent_thread.start()
+        if not futures:
+            message.ack()
+            return
         
-        # Acknowledge immediately
-        message.ack()
+        # Keep the notification leased until its agent runs are done, so
+        # flow control stops Pub/Sub from handing us more than we can process
+        ack_when_done(message, futures)
         
     except Exception as e:
         print(f"❌ Error processing message: {e}")
+        _notifications.inc(outcome="error")
+        metrics.log_event("notification_error", pubsub_message_id=message.message_id, error=str(e))
+        # Let the redelivery through the dedup check
+        processed_messages.discard(f"pubsub:{message.message_id}")
         message.nack()
 
 # Main listener
@@ -122,6 +466,7 @@ def main():
     print("="*60)
     print(f"Project: {PROJECT_ID}")
     print(f"Subscription: {SUBSCRIPTION_ID}")
+    print(f"Agent concurrency: {AGENT_MAX_CONCURRENCY} (max outstanding notifications: {PUBSUB_MAX_OUTSTANDING})")
     print("\n📬 Waiting for incoming emails...")
     print("Press Ctrl+C to stop\n")
     
@@ -129,10 +474,18 @@ def main():
     subscriber = pubsub_v1.SubscriberClient()
     subscription_path = subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID)
     
+    # Start the agent pool before any notification can arrive
+    agent_pool.start()
+    metrics.register_collector("agent_pool", agent_pool.stats)
+    metrics.register_collector("dedup_cache", processed_messages.stats)
+    metrics.start_exporter("email_listener", METRICS_PORT)
+    
     # Start listening
+    flow_control = pubsub_v1.types.FlowControl(max_messages=PUBSUB_MAX_OUTSTANDING)
     streaming_pull_future = subscriber.subscribe(
         subscription_path,
-        callback=process_notification
+        callback=process_notification,
+        flow_control=flow_control
     )
     
     try:
@@ -140,6 +493,7 @@ def main():
     except KeyboardInterrupt:
         streaming_pull_future.cancel()
         streaming_pull_future.result()
+        agent_pool.stop()
         print("\n\n⏹️ Listener stopped")
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
 # google/gmail/server.py
 from __future__ import annotations
 
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Optional
 
@@ -9,6 +11,11 @@ from google_auth_oauthlib.flow import InstalledAppFlow#to handle oauth flow for
 from google.auth.transport.requests import Request#to refresh the token if it is expired
 from googleapiclient.discovery import build
 
+try:
+    from auth.transport import PooledHttp
+except ImportError:  # run directly as a script for the smoke test below
+    from transport import PooledHttp
+
 # Minimal, safe scope to start. We can expand later.
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",     
@@ -23,10 +30,46 @@ BASE_DIR = Path(__file__).parent
 CREDS_FILE = BASE_DIR / "credentials.json"
 TOKEN_FILE = BASE_DIR / "token.json"
 
+# Refresh the shared token this long before Google says it expires, so a
+# request that starts just before expiry never goes out with a dead token.
+REFRESH_MARGIN = timedelta(minutes=5)
 
-def get_credentials(scopes: Optional[list[str]] = None) -> Credentials:#handles the authentication part
-    """Load/refresh credentials; if not present, run the local OAuth flow."""
-    use_scopes = scopes or SCOPES
+# Process-wide caches: one Credentials object per scope set and one API client
+# per (api, version, scopes). Building a client parses the discovery document,
+# so doing it once per process instead of once per tool call matters.
+_creds_cache: dict[tuple[str, ...], Credentials] = {}
+_service_cache: dict[tuple, object] = {}
+# One pooled, thread-safe transport per scope set, shared by all clients
+_transports: dict[tuple[str, ...], PooledHttp] = {}
+_cache_lock = threading.Lock()
+
+_cache_stats = {
+    "credential_hits": 0,
+    "credential_loads": 0,
+    "credential_refreshes": 0,
+    "service_hits": 0,
+    "service_builds": 0,
+}
+
+
+def get_cache_stats() -> dict:
+    """Return a snapshot of the credential/client cache counters."""
+    with _cache_lock:
+        return dict(_cache_stats)
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth keeps `expiry` as a naive UTC datetime
+    expiry = creds.expiry if creds.expiry.tzinfo else creds.expiry.replace(tzinfo=timezone.utc)
+    return expiry - REFRESH_MARGIN <= datetime.now(timezone.utc)
+
+
+def _load_credentials(use_scopes: list[str]) -> Credentials:
+    """Load/refresh credentials from disk; if not present, run the local OAuth flow."""
     creds: Optional[Credentials] = None
 
     if TOKEN_FILE.exists():
@@ -36,6 +79,7 @@ def get_credentials(scopes: Optional[list[str]] = None) -> Credentials:#handles
     if not creds or not creds.valid:#this part of the code checks is the token is expired if it is expired then we will refresh it of perform the login again
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
+            _cache_stats["credential_refreshes"] += 1
         else:
             if not CREDS_FILE.exists():
                 raise FileNotFoundError(
@@ -51,15 +95,82 @@ def get_credentials(scopes: Optional[list[str]] = None) -> Credentials:#handles
     return creds
 
 
+def get_credentials(scopes: Optional[list[str]] = None) -> Credentials:#handles the authentication part
+    """
+    Return the shared credentials for `scopes`.
+
+    token.json is read once per process. After that the same Credentials
+    object is handed out and refreshed in place shortly before it expires,
+    so API clients built on top of it keep working without being rebuilt.
+    """
+    use_scopes = scopes or SCOPES
+    key = tuple(use_scopes)
+
+    with _cache_lock:
+        creds = _creds_cache.get(key)
+        if creds is None:
+            creds = _load_credentials(use_scopes)
+            _creds_cache[key] = creds
+            _cache_stats["credential_loads"] += 1
+        elif _needs_refresh(creds) and creds.refresh_token:
+            creds.refresh(Request())
+            TOKEN_FILE.write_text(creds.to_json())
+            _cache_stats["credential_refreshes"] += 1
+        else:
+            _cache_stats["credential_hits"] += 1
+
+    return creds
+
+
+def get_service(api: str, version: str, scopes: Optional[list[str]] = None):
+    """
+    Return a cached, authenticated API client for (api, version, scopes).
+
+    Clients are built from the discovery documents bundled with
+    google-api-python-client (static_discovery=True), so neither startup nor
+    the first call fetches discovery metadata over the network. All clients
+    share one pooled keep-alive transport (see auth/transport.py), which is
+    thread-safe, so a single client can serve every tool thread.
+    """
+    use_scopes = scopes or SCOPES
+    key = (api, version, tuple(use_scopes))
+
+    # Always go through get_credentials() so the shared token is refreshed
+    # ahead of expiry even when the client itself is a cache hit.
+    creds = get_credentials(use_scopes)
+
+    with _cache_lock:
+        service = _service_cache.get(key)
+        if service is not None:
+            _cache_stats["service_hits"] += 1
+            return service
+
+        http = _transports.get(key[2])
+        if http is None:
+            http = _transports[key[2]] = PooledHttp(creds)
+        service = build(api, version, http=http, static_discovery=True)
+        _service_cache[key] = service
+        _cache_stats["service_builds"] += 1
+        return service
+
+
+def clear_service_cache() -> None:
+    """Drop cached credentials and clients (e.g. after token.json was replaced)."""
+    with _cache_lock:
+        _creds_cache.clear()
+        _service_cache.clear()
+        for http in _transports.values():
+            http.close()
+        _transports.clear()
+
+
 def get_gmail_service():
     """Return an authenticated Gmail API client."""
-    creds = get_credentials()
-    return build("gmail", "v1", credentials=creds)
+    return get_service("gmail", "v1")
 
 def get_drive_service():
-    """Return an authenticated Gmail API client."""
-    creds = get_credentials()
-    return build("drive", "v3", credentials=creds)
+    """Return an authenticated Drive API client."""
+    return get_service("drive", "v3")
 
 
 if __name__ == "__main__":
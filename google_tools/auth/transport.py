@@ -0,0 +1,102 @@
+"""
+Pooled, thread-safe HTTP transport for googleapiclient.
+
+googleapiclient talks to an httplib2-style object: `http.request(uri, method,
+body, headers)` returning `(response, content)`. By default every `build()`
+gets its own httplib2.Http, which is not thread-safe and keeps at most one
+connection per host, so TCP+TLS handshakes are repeated across clients.
+
+PooledHttp implements that interface on top of google-auth's
+AuthorizedSession (requests + urllib3), so one keep-alive connection pool is
+shared by every Gmail and Drive client in the process and tokens are
+attached and refreshed by google-auth.
+"""
+from __future__ import annotations
+
+import os
+import time
+from urllib.parse import urlsplit
+
+import httplib2
+import requests
+from google.auth.transport.requests import AuthorizedSession
+
+try:
+    from utils import metrics
+except ImportError:  # auth.py run directly as a script; nothing to export then
+    metrics = None
+
+# Connections kept open per host (gmail.googleapis.com, www.googleapis.com, ...)
+HTTP_POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "16"))
+# Number of distinct hosts to keep pools for
+HTTP_POOL_HOSTS = int(os.getenv("GOOGLE_HTTP_POOL_HOSTS", "4"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "60"))
+
+if metrics is not None:
+    _requests = metrics.counter("google_api_requests_total", "HTTP requests sent to Google APIs")
+    _latency = metrics.histogram("google_api_request_seconds", "Latency of HTTP requests to Google APIs")
+    _bytes_out = metrics.counter("google_api_bytes_sent_total", "Request body bytes sent to Google APIs")
+    _bytes_in = metrics.counter("google_api_bytes_received_total", "Decoded response bytes received from Google APIs")
+
+
+def _record(uri: str, method: str, status: int, body, content: bytes, elapsed: float) -> None:
+    # Batch and upload calls share hosts; the first path segment tells the API apart
+    parts = urlsplit(uri)
+    segments = [s for s in parts.path.split("/") if s]
+    if segments and segments[0] in ("batch", "upload"):
+        segments = segments[1:]
+    api = segments[0] if segments else ""
+    labels = {"host": parts.hostname or "", "api": api}
+    _requests.inc(method=method, status=status, **labels)
+    _latency.observe(elapsed, **labels)
+    if body:
+        _bytes_out.inc(len(body) if isinstance(body, (bytes, str)) else 0, **labels)
+    _bytes_in.inc(len(content), **labels)
+
+
+class PooledHttp:
+    """httplib2.Http look-alike backed by a shared, pooled AuthorizedSession."""
+
+    def __init__(self, credentials, pool_size: int = HTTP_POOL_SIZE, timeout: float = HTTP_TIMEOUT_SECONDS):
+        # googleapiclient's batch support reads `.credentials` to sign each
+        # part of a batch request
+        self.credentials = credentials
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=HTTP_POOL_HOSTS,
+            pool_maxsize=pool_size,
+        )
+        self.session.mount("https://", adapter)
+        # Ask for compressed responses; requests decompresses them transparently
+        self.session.headers["Accept-Encoding"] = "gzip"
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        start = time.perf_counter()
+        response = self.session.request(
+            method,
+            uri,
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+            allow_redirects=redirections > 0,
+        )
+        content = response.content
+        if metrics is not None:
+            _record(uri, method, response.status_code, body, content, time.perf_counter() - start)
+
+        info = {k.lower(): v for k, v in response.headers.items()}
+        if "content-encoding" in info:
+            # `content` is already decoded; don't let callers see stale
+            # compressed-length headers
+            info.pop("content-encoding")
+            info["content-length"] = str(len(content))
+        info["status"] = str(response.status_code)
+
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, content
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,102 @@
+"""
+On-disk cache of text extracted from Drive files.
+
+Entries are content-addressed: the key is derived from the file ID, the
+file's revision (md5Checksum for binary files, modifiedTime for Google
+Docs/Sheets, which have no checksum) and the export MIME type. A changed
+file therefore simply misses the cache; stale entries age out through LRU
+eviction once the cache grows past its byte budget.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+CACHE_DIR = Path(os.getenv("DRIVE_CACHE_DIR", Path(__file__).parent / ".drive_cache"))
+CACHE_MAX_BYTES = int(os.getenv("DRIVE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+def revision_of(metadata: dict) -> str:
+    """Cheapest reliable revision marker for a files().get() result."""
+    return metadata.get("md5Checksum") or metadata.get("modifiedTime") or ""
+
+
+class ExtractionCache:
+    """Byte-bounded LRU cache of JSON payloads, one file per entry."""
+
+    def __init__(self, directory: Path | str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(file_id: str, revision: str, export_mime: str) -> str:
+        return hashlib.sha256(f"{file_id}\0{revision}\0{export_mime}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        # Bump mtime so eviction treats this entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return payload
+
+    def put(self, key: str, payload: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(".json"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            # Oldest (least recently used) first
+            for _mtime, size, path in sorted(entries):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
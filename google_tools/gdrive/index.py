@@ -0,0 +1,238 @@
+"""
+Local full-text index over text extracted from Drive files.
+
+Documents are split into chunks (PDF pages, groups of sheet rows, runs of
+paragraphs) and stored in an SQLite FTS5 table, so the agent can find the
+relevant part of a document with one local BM25 query instead of reading
+whole files into its context.
+
+The index also keeps the Drive changes().list page token it was last synced
+to and a queue of files waiting to be (re)indexed; gdrive.tools drives the
+sync.
+"""
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+INDEX_PATH = Path(os.getenv("DRIVE_INDEX_PATH", Path(__file__).parent / "content_index.sqlite3"))
+# Target size of one indexed chunk of plain text
+INDEX_CHUNK_CHARS = int(os.getenv("DRIVE_INDEX_CHUNK_CHARS", "2000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    file_id TEXT PRIMARY KEY,
+    name TEXT,
+    mime_type TEXT,
+    revision TEXT,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS pending (
+    file_id TEXT PRIMARY KEY,
+    queued_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+    file_id UNINDEXED,
+    location UNINDEXED,
+    name UNINDEXED,
+    text,
+    tokenize = 'porter unicode61'
+);
+"""
+
+_WORDS = re.compile(r"\w+", re.UNICODE)
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+
+
+def chunk_text(text: str, max_chars: int = INDEX_CHUNK_CHARS) -> list[tuple[str, str]]:
+    """Split plain text into (location, text) chunks on paragraph boundaries."""
+    chunks = []
+    current: list[str] = []
+    size = 0
+    for paragraph in _PARAGRAPHS.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and size + len(paragraph) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        # Oversized paragraphs (e.g. text without blank lines) are cut hard
+        while len(paragraph) > max_chars:
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        current.append(paragraph)
+        size += len(paragraph)
+    if current:
+        chunks.append("\n\n".join(current))
+    return [(f"part {n}", chunk) for n, chunk in enumerate(chunks, start=1)]
+
+
+def _match_query(query: str, operator: str) -> str:
+    """Turn free text into an FTS5 query of quoted terms (no syntax errors)."""
+    return f" {operator} ".join(f'"{word}"' for word in _WORDS.findall(query))
+
+
+class ContentIndex:
+    """Thread-safe wrapper around the SQLite FTS5 content index."""
+
+    def __init__(self, path: Path | str = INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(pending)")}
+            if "attempts" not in columns:
+                # Index files created before failed files were retried later
+                self._conn.execute("ALTER TABLE pending ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- documents ----------
+
+    def revision(self, file_id: str) -> Optional[str]:
+        """Revision the indexed text of `file_id` came from (None if not indexed)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT revision FROM documents WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        return row["revision"] if row else None
+
+    def put(self, file_id: str, name: str, mime_type: str, revision: str,
+            chunks: Iterable[tuple[str, str]]) -> int:
+        """Replace the indexed chunks of one file; returns the number of chunks."""
+        rows = [(file_id, location, name, text) for location, text in chunks if text.strip()]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            self._conn.executemany(
+                "INSERT INTO chunks (file_id, location, name, text) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (file_id, name, mime_type, revision, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (file_id, name, mime_type, revision, time.time()),
+            )
+            self._conn.execute("DELETE FROM pending WHERE file_id = ?", (file_id,))
+        return len(rows)
+
+    def delete(self, file_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM documents WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM pending WHERE file_id = ?", (file_id,))
+
+    def search(self, query: str, k: int = 5, snippet_tokens: int = 32) -> list[dict]:
+        """
+        Return the `k` best-matching chunks for free-text `query`, best first.
+
+        All terms must match; if nothing does, any term may match.
+        """
+        for operator in ("AND", "OR"):
+            match = _match_query(query, operator)
+            if not match:
+                return []
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT file_id, location, name, bm25(chunks) AS score, "
+                    "snippet(chunks, 3, '[', ']', '…', ?) AS snippet "
+                    "FROM chunks WHERE chunks MATCH ? ORDER BY score LIMIT ?",
+                    (snippet_tokens, match, k),
+                ).fetchall()
+            if rows:
+                return [
+                    {
+                        "file_id": row["file_id"],
+                        "name": row["name"],
+                        "location": row["location"],
+                        # bm25() is lower-is-better; flip it for readability
+                        "score": round(-row["score"], 3),
+                        "snippet": row["snippet"],
+                    }
+                    for row in rows
+                ]
+        return []
+
+    # ---------- sync state ----------
+
+    def queue(self, file_ids: Iterable[str]) -> None:
+        """Mark files as needing (re)indexing."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO pending (file_id, queued_at) VALUES (?, ?)",
+                [(file_id, now) for file_id in file_ids],
+            )
+
+    def pending(self, limit: int) -> list[str]:
+        """Oldest queued file IDs first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_id FROM pending ORDER BY queued_at LIMIT ?", (limit,)
+            ).fetchall()
+        return [row["file_id"] for row in rows]
+
+    def defer(self, file_id: str) -> int:
+        """Move a file that failed to index to the back of the queue; returns its failure count."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pending SET queued_at = ?, attempts = attempts + 1 WHERE file_id = ?",
+                (time.time(), file_id),
+            )
+            row = self._conn.execute(
+                "SELECT attempts FROM pending WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        return row["attempts"] if row else 0
+
+    def unqueue(self, file_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pending WHERE file_id = ?", (file_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            pending = self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+        return {"documents": documents, "pending": pending}
+
+    def _get_state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_state(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    @property
+    def page_token(self) -> Optional[str]:
+        """Drive changes().list page token the index is in sync with (None before bootstrap)."""
+        return self._get_state("page_token")
+
+    @page_token.setter
+    def page_token(self, value: str) -> None:
+        self._set_state("page_token", value)
+
+    @property
+    def synced_at(self) -> float:
+        value = self._get_state("synced_at")
+        return float(value) if value else 0.0
+
+    @synced_at.setter
+    def synced_at(self, value: float) -> None:
+        self._set_state("synced_at", str(value))
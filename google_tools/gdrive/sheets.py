@@ -0,0 +1,194 @@
+"""
+Paged reads of tabular Drive files (Google Sheets exports and CSV files).
+
+The CSV is streamed to a temp file by the caller and parsed here row by
+row, so an export is never decoded into one giant string. Parsed tables are
+cached per file revision, in memory and in the on-disk extraction cache,
+so paging through a large sheet exports and parses it only once.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Rows returned per call when the caller gives no limit
+SHEET_PAGE_ROWS = int(os.getenv("SHEET_PAGE_ROWS", "100"))
+# Total cells of parsed tables kept in memory
+SHEET_CACHE_MAX_CELLS = int(os.getenv("SHEET_CACHE_MAX_CELLS", "2000000"))
+
+_INTEGER = re.compile(r"[-+]?\d{1,3}(?:,\d{3})*$|[-+]?\d+$")
+_NUMBER = re.compile(r"[-+]?(?:\d[\d,]*)?\.?\d+(?:[eE][-+]?\d+)?%?$|[-+]?[$€£]\s?[\d,]+(?:\.\d+)?$")
+_DATE = re.compile(r"\d{4}-\d{1,2}-\d{1,2}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?$|\d{1,2}/\d{1,2}/\d{2,4}(?: \d{1,2}:\d{2}(?::\d{2})?)?$")
+_BOOLEANS = frozenset({"true", "false"})
+
+
+def _value_type(value: str) -> Optional[str]:
+    """Type of one cell: integer, number, boolean, date, string (None if empty)."""
+    value = value.strip()
+    if not value:
+        return None
+    if _INTEGER.match(value):
+        return "integer"
+    if _NUMBER.match(value):
+        return "number"
+    if value.lower() in _BOOLEANS:
+        return "boolean"
+    if _DATE.match(value):
+        return "date"
+    return "string"
+
+
+def _merge_types(current: Optional[str], new: Optional[str]) -> Optional[str]:
+    if new is None or current == new:
+        return current
+    if current is None:
+        return new
+    if {current, new} == {"integer", "number"}:
+        return "number"
+    return "string"
+
+
+def _column_names(header: list[str]) -> list[str]:
+    """Header row with blanks and duplicates made unique (column_3, Name_2, ...)."""
+    names = []
+    seen: set[str] = set()
+    for index, name in enumerate(header, start=1):
+        name = name.strip() or f"column_{index}"
+        unique, n = name, 2
+        while unique in seen:
+            unique, n = f"{name}_{n}", n + 1
+        seen.add(unique)
+        names.append(unique)
+    return names
+
+
+class Table:
+    """A parsed CSV: column names, data rows and inferred column types."""
+
+    def __init__(self, columns: list[str], rows: list[list[str]], types: list[Optional[str]]):
+        self.columns = columns
+        self.rows = rows
+        self.types = types
+
+    @classmethod
+    def parse(cls, fh) -> "Table":
+        """Parse CSV from the binary file object `fh`, one row at a time."""
+        reader = csv.reader(io.TextIOWrapper(fh, encoding="utf-8", errors="replace", newline=""))
+        header = next(reader, [])
+        width = len(header)
+        rows = []
+        types: list[Optional[str]] = [None] * width
+        for row in reader:
+            if not any(row):
+                continue
+            if len(row) > width:
+                # Ragged data wider than the header gets generated column names
+                types.extend([None] * (len(row) - width))
+                header = header + [""] * (len(row) - width)
+                width = len(row)
+            for index, value in enumerate(row):
+                if types[index] != "string":
+                    types[index] = _merge_types(types[index], _value_type(value))
+            rows.append(row)
+        return cls(_column_names(header), rows, types)
+
+    @property
+    def cells(self) -> int:
+        return len(self.rows) * max(len(self.columns), 1)
+
+    def schema(self) -> dict:
+        return {
+            "columns": [{"name": name, "type": kind or "empty"}
+                        for name, kind in zip(self.columns, self.types)],
+            "row_count": len(self.rows),
+        }
+
+    def page(self, offset: int = 0, limit: Optional[int] = None,
+             columns: Optional[list[str]] = None, max_chars: Optional[int] = None) -> dict:
+        """
+        Rows offset..offset+limit, projected onto `columns` (names, in the
+        requested order). Stops early once about `max_chars` characters of
+        cell text were collected.
+
+        Raises KeyError for unknown column names.
+        """
+        if columns:
+            unknown = [c for c in columns if c not in self.columns]
+            if unknown:
+                raise KeyError(", ".join(unknown))
+            indexes = [self.columns.index(c) for c in columns]
+        else:
+            indexes = list(range(len(self.columns)))
+            columns = self.columns
+
+        offset = max(offset, 0)
+        limit = SHEET_PAGE_ROWS if limit is None else max(limit, 0)
+        end = min(offset + limit, len(self.rows))
+        rows = []
+        size = 0
+        for row in self.rows[offset:end]:
+            values = [row[i] if i < len(row) else "" for i in indexes]
+            size += sum(len(v) + 1 for v in values)
+            if max_chars is not None and size > max_chars and rows:
+                break
+            rows.append(values)
+
+        next_offset = offset + len(rows)
+        return {
+            "columns": list(columns),
+            "rows": rows,
+            "offset": offset,
+            "next_offset": next_offset if next_offset < len(self.rows) else None,
+            "truncated": next_offset < end,
+        }
+
+    def to_cache(self) -> dict:
+        return {"columns": self.columns, "rows": self.rows, "types": self.types}
+
+    @classmethod
+    def from_cache(cls, payload: dict) -> "Table":
+        return cls(payload["columns"], payload["rows"], payload["types"])
+
+
+class TableCache:
+    """In-memory LRU of parsed tables, bounded by their total number of cells."""
+
+    def __init__(self, max_cells: int = SHEET_CACHE_MAX_CELLS):
+        self.max_cells = max_cells
+        self.hits = 0
+        self.misses = 0
+        self._tables: OrderedDict[str, Table] = OrderedDict()
+        self._cells = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Table]:
+        with self._lock:
+            table = self._tables.get(key)
+            if table is None:
+                self.misses += 1
+                return None
+            self._tables.move_to_end(key)
+            self.hits += 1
+            return table
+
+    def put(self, key: str, table: Table) -> None:
+        if table.cells > self.max_cells:
+            return
+        with self._lock:
+            old = self._tables.pop(key, None)
+            if old is not None:
+                self._cells -= old.cells
+            self._tables[key] = table
+            self._cells += table.cells
+            while self._cells > self.max_cells:
+                _key, evicted = self._tables.popitem(last=False)
+                self._cells -= evicted.cells
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tables": len(self._tables), "cells": self._cells, "hits": self.hits, "misses": self.misses}
@@ -1,93 +1,366 @@
 from auth.auth import get_drive_service
-from io import BytesIO
 from PyPDF2 import PdfReader
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import DEFAULT_CHUNK_SIZE, MediaIoBaseDownload
 import io
 import os
 import base64
+import hashlib
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from googleapiclient.errors import HttpError
+from gdrive.cache import ExtractionCache, revision_of
+from gdrive.index import ContentIndex, chunk_text
+from gdrive.sheets import Table, TableCache
+from utils import metrics
+from utils.retry import execute, throttle, MAX_ATTEMPTS
 
-def list_drive_files() -> list[dict]:
+# Upper bound on text returned to the LLM for a single file
+READ_MAX_CHARS = int(os.getenv("DRIVE_READ_MAX_CHARS", "100000"))
+# Chunk size for streamed Drive downloads. Each chunk is one HTTP request, so
+# bigger chunks mean fewer round trips; the library default (100 MiB) fetches
+# most files in one request. At most one chunk is held in memory at a time.
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_DOWNLOAD_CHUNK_SIZE", str(DEFAULT_CHUNK_SIZE)))
+
+_download_seconds = metrics.histogram("drive_download_seconds", "Streamed Drive downloads and exports")
+_parse_seconds = metrics.histogram("drive_parse_seconds", "Local parsing of downloaded Drive files (PDF page, CSV table)")
+
+# Only the fields the agent needs; keeps Drive responses and LLM context small
+DRIVE_LIST_FIELDS = "nextPageToken, files(id, name, mimeType, modifiedTime)"
+# Drive caps pageSize at 1000; the agent rarely needs more than a handful
+MAX_PAGE_SIZE = 100
+
+def iter_drive_pages(service, query: str | None = None, order_by: str | None = "modifiedTime desc",
+                     page_size: int = 10, page_token: str | None = None, fields: str = DRIVE_LIST_FIELDS):
+    """
+    Yield (files, next_page_token) one Drive result page at a time.
+
+    Pages are only requested as the caller iterates, so taking the first
+    page costs exactly one API call.
+    """
+    while True:
+        results = execute(service.files().list(
+            q=query,
+            orderBy=order_by,
+            pageSize=max(1, min(page_size, MAX_PAGE_SIZE)),
+            pageToken=page_token,
+            fields=fields,
+        ))
+        page_token = results.get("nextPageToken")
+        yield results.get("files", []), page_token
+        if not page_token:
+            return
+
+
+def _file_summary(file: dict) -> dict:
+    return {
+        "name": file["name"],
+        "id": file["id"],
+        "type": file["mimeType"],
+        "modified": file.get("modifiedTime"),
+    }
+
+
+def list_drive_files(query: str | None = None, order_by: str | None = "modifiedTime desc",
+                     page_size: int = 10, page_token: str | None = None) -> dict:
     """
-    List the first 10 files in Google Drive with name and id.
+    List one page of Google Drive files with name, id, type and modified time.
+
+    Args:
+        query (str, optional): Drive search filter, e.g. "mimeType='application/pdf'".
+            Trashed files are always excluded.
+        order_by (str): Drive sort order, e.g. "modifiedTime desc" or "name".
+        page_size (int): Number of files to return (max 100).
+        page_token (str, optional): next_page_token from a previous call.
+
+    Returns:
+        dict: {"files": [...], "next_page_token": str | None}
     """
     service = get_drive_service()
 
-    results = service.files().list(
-        pageSize=10,
-        fields="files(id, name, mimeType)"
-    ).execute()
+    q = "trashed = false"
+    if query:
+        q = f"({query}) and {q}"
 
-    files = results.get("files", [])
+    files, next_page_token = next(iter_drive_pages(
+        service, query=q, order_by=order_by, page_size=page_size, page_token=page_token
+    ))
 
     if not files:
-        return [{"message": "No files found."}]
+        return {"files": [], "next_page_token": None, "message": "No files found."}
 
     return {
-    "files": [
-        {"name": file["name"], "id": file["id"], "type": file["mimeType"]}
-        for file in files
-    ]
-}
+        "files": [_file_summary(file) for file in files],
+        "next_page_token": next_page_token
+    }
+
+
+def _quote_query_value(value: str) -> str:
+    """Escape a value for a single-quoted string in a Drive `q` query."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def search_drive_files(text: str, mime_type: str | None = None,
+                       page_size: int = 10, page_token: str | None = None) -> dict:
+    """
+    Search Drive by file name or content.
+
+    Args:
+        text (str): Words to look for in the file name or body.
+        mime_type (str, optional): Restrict to one MIME type, e.g. "application/pdf".
+        page_size (int): Number of files to return (max 100).
+        page_token (str, optional): next_page_token from a previous call.
+
+    Returns:
+        dict: {"files": [...], "next_page_token": str | None}
+    """
+    escaped = _quote_query_value(text)
+    query = f"(name contains '{escaped}' or fullText contains '{escaped}')"
+    if mime_type:
+        query += f" and mimeType = '{_quote_query_value(mime_type)}'"
+    # Drive rejects orderBy on fullText queries; results come back by relevance
+    return list_drive_files(query=query, order_by=None, page_size=page_size, page_token=page_token)
 
 #read file contents
 
-def read_drive_file(file_id: str) -> dict:
+def _download_to_file(service, file_id: str, fh, request=None) -> None:
+    """
+    Stream a Drive file into `fh` chunk by chunk instead of holding it all in memory.
+
+    `request` overrides the default get_media() download (e.g. an export_media()).
+    """
+    if request is None:
+        request = service.files().get_media(fileId=file_id)
+    downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+    done = False
+    with _download_seconds.time():
+        while done is False:
+            throttle("drive.files.get")
+            status, done = downloader.next_chunk(num_retries=MAX_ATTEMPTS - 1)
+    fh.seek(0)
+
+
+class _PdfPages:
+    """
+    Page texts of one PDF revision, parsed on demand.
+
+    Pages already in the extraction cache are served from it; the PDF is
+    only downloaded and opened the first time a missing page is needed.
+    """
+
+    def __init__(self, service, file_id: str, cached: dict | None):
+        cached = cached or {}
+        self.service = service
+        self.file_id = file_id
+        self.total = cached.get("total_pages")
+        self.pages = {int(k): v for k, v in cached.get("pages", {}).items()}
+        self.parsed = 0
+        self._fh = None
+        self._reader = None
+
+    def _open(self):
+        # Spool to a temp file so large PDFs never sit in memory as one blob
+        self._fh = tempfile.TemporaryFile()
+        _download_to_file(self.service, self.file_id, self._fh)
+        self._reader = PdfReader(self._fh)
+        self.total = len(self._reader.pages)
+
+    def total_pages(self) -> int:
+        if self.total is None:
+            self._open()
+        return self.total
+
+    def text(self, index: int) -> str:
+        if index not in self.pages:
+            if self._reader is None:
+                self._open()
+            with _parse_seconds.time(kind="pdf_page"):
+                self.pages[index] = self._reader.pages[index].extract_text() or ""
+            self.parsed += 1
+        return self.pages[index]
+
+    def to_cache(self) -> dict:
+        return {"total_pages": self.total, "pages": {str(k): v for k, v in self.pages.items()}}
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+
+
+def _extract_pdf_text(pages: _PdfPages, start_page: int, end_page: int | None, max_chars: int) -> dict:
+    """
+    Extract text from pages start_page..end_page (1-based, inclusive).
+
+    Pages are parsed lazily and extraction stops as soon as `max_chars`
+    is reached, so the rest of a large PDF is never parsed.
+    """
+    total_pages = pages.total_pages()
+    first = max(start_page, 1)
+    last = min(end_page or total_pages, total_pages)
+
+    chunks = []
+    size = 0
+    pages_read = 0
+    truncated = False
+    for index in range(first - 1, last):
+        page_text = pages.text(index)
+        pages_read += 1
+        if size + len(page_text) >= max_chars:
+            chunks.append(page_text[:max(0, max_chars - size)])
+            truncated = index + 1 < last or size + len(page_text) > max_chars
+            break
+        chunks.append(page_text)
+        size += len(page_text)
+
+    return {
+        "content": "".join(chunks),
+        "total_pages": total_pages,
+        "pages_read": f"{first}-{first + pages_read - 1}" if pages_read else "",
+        "truncated": truncated,
+    }
+
+
+def _limit(text: str, max_chars: int) -> tuple[str, bool]:
+    if len(text) > max_chars:
+        return text[:max_chars], True
+    return text, False
+
+
+# Extracted text keyed by (file_id, revision, export mime type)
+extraction_cache = ExtractionCache()
+
+def _cached_text(file_id: str, revision: str, export_mime: str, fetch) -> tuple[str, bool]:
+    """Return (text, cached); `fetch()` returns the raw bytes on a cache miss."""
+    key = ExtractionCache.key(file_id, revision, export_mime)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        return cached["text"], True
+    text = fetch().decode("utf-8", errors="ignore")
+    extraction_cache.put(key, {"text": text})
+    return text, False
+
+
+# Parsed sheets keyed like the extraction cache; avoids re-reading the JSON per page
+table_cache = TableCache()
+
+def _cached_table(service, file_id: str, revision: str, mime_type: str) -> tuple[Table, bool]:
+    """
+    Return (table, cached) for a Google Sheet or CSV file.
+
+    Looks in memory, then in the on-disk extraction cache, and only then
+    streams the CSV to a temp file and parses it incrementally.
+    """
+    key = ExtractionCache.key(file_id, revision, "table/csv")
+    table = table_cache.get(key)
+    if table is not None:
+        return table, True
+    payload = extraction_cache.get(key)
+    if payload is not None:
+        table = Table.from_cache(payload)
+        table_cache.put(key, table)
+        return table, True
+
+    if mime_type == "application/vnd.google-apps.spreadsheet":
+        # Drive exports only the first sheet of a spreadsheet as CSV
+        request = service.files().export_media(fileId=file_id, mimeType="text/csv")
+    else:
+        request = service.files().get_media(fileId=file_id)
+    with tempfile.TemporaryFile() as fh:
+        _download_to_file(service, file_id, fh, request)
+        with _parse_seconds.time(kind="csv_table"):
+            table = Table.parse(fh)
+    table_cache.put(key, table)
+    extraction_cache.put(key, table.to_cache())
+    return table, False
+
+
+def read_drive_file(file_id: str, start_page: int = 1, end_page: int | None = None, max_chars: int = READ_MAX_CHARS,
+                    offset: int = 0, limit: int | None = None, columns: list[str] | None = None) -> dict:
     """
     Read file contents by Drive file ID and return text content.
-    Supports: Google Docs, Google Sheets, PDFs, plain text, JSON.
+    Supports: Google Docs, Google Sheets, PDFs, plain text, JSON, CSV.
+
+    Extracted text is cached on disk per file revision, so re-reading an
+    unchanged file costs one small metadata call and no export or parsing.
+
+    Google Sheets and CSV files are returned as a page of rows plus a schema
+    (column names and types, row count) instead of one big CSV string.
+
+    Args:
+        file_id (str): Google Drive file ID.
+        start_page (int): First PDF page to read (1-based). Ignored for other types.
+        end_page (int, optional): Last PDF page to read (inclusive). Defaults to the last page.
+        max_chars (int): Maximum number of characters of content to return.
+        offset (int): First data row to return (0-based). Sheets/CSV only.
+        limit (int, optional): Number of rows to return. Defaults to SHEET_PAGE_ROWS.
+        columns (list[str], optional): Column names to return, in this order.
     """
+    # A negative limit would slice from the end and return almost everything
+    max_chars = max(0, max_chars)
 
     service = get_drive_service()
 
-    # Get file metadata
-    file = service.files().get(fileId=file_id).execute()
+    # Get file metadata (only what we need to pick a reader and validate the cache)
+    file = execute(service.files().get(
+        fileId=file_id,
+        fields="name,mimeType,modifiedTime,md5Checksum"
+    ))
     mime_type = file.get("mimeType")
     name = file.get("name")
+    revision = revision_of(file)
 
     # -------------------------
     # Google Docs → export text
     # -------------------------
     if mime_type == "application/vnd.google-apps.document":
-        data = service.files().export(
-            fileId=file_id,
-            mimeType="text/plain"
-        ).execute()
-        text = data.decode("utf-8", errors="ignore")
-        return {"name": name, "type": mime_type, "content": text}
+        text, cached = _cached_text(
+            file_id, revision, "text/plain",
+            lambda: execute(service.files().export(fileId=file_id, mimeType="text/plain"))
+        )
+        _keep_indexed(service, file_id, file)
+        text, truncated = _limit(text, max_chars)
+        return {"name": name, "type": mime_type, "content": text, "truncated": truncated, "cached": cached}
 
     # -------------------------
-    # Google Sheets → export CSV
+    # Google Sheets / CSV → paged rows
     # -------------------------
-    if mime_type == "application/vnd.google-apps.spreadsheet":
-        data = service.files().export(
-            fileId=file_id,
-            mimeType="text/csv"
-        ).execute()
-        text = data.decode("utf-8", errors="ignore")
-        return {"name": name, "type": mime_type, "content": text}
+    if mime_type in ("application/vnd.google-apps.spreadsheet", "text/csv"):
+        table, cached = _cached_table(service, file_id, revision, mime_type)
+        _keep_indexed(service, file_id, file)
+        try:
+            page = table.page(offset, limit, columns, max_chars)
+        except KeyError as e:
+            return {"error": f"Unknown column(s): {e.args[0]}", "schema": table.schema()}
+        return {"name": name, "type": mime_type, "schema": table.schema(), **page, "cached": cached}
 
     # -------------------------
     # PDF handling
     # -------------------------
     if mime_type == "application/pdf":
-        request = service.files().get_media(fileId=file_id)
-        file_data = BytesIO(request.execute())
-        reader = PdfReader(file_data)
-
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
+        key = ExtractionCache.key(file_id, revision, "application/pdf")
+        pages = _PdfPages(service, file_id, extraction_cache.get(key))
+        try:
+            result = _extract_pdf_text(pages, start_page, end_page, max_chars)
+        finally:
+            pages.close()
+        if pages.parsed:
+            extraction_cache.put(key, pages.to_cache())
+        _keep_indexed(service, file_id, file)
 
-        return {"name": name, "type": mime_type, "content": text}
+        return {"name": name, "type": mime_type, **result, "cached": pages.parsed == 0}
 
     # -------------------------
     # Plain text, JSON, Markdown
     # -------------------------
     if mime_type.startswith("text/") or mime_type in ["application/json"]:
-        request = service.files().get_media(fileId=file_id)
-        file_bytes = request.execute()
-        text = file_bytes.decode("utf-8", errors="ignore")
-        return {"name": name, "type": mime_type, "content": text}
+        text, cached = _cached_text(
+            file_id, revision, mime_type,
+            lambda: execute(service.files().get_media(fileId=file_id))
+        )
+        _keep_indexed(service, file_id, file)
+        text, truncated = _limit(text, max_chars)
+        return {"name": name, "type": mime_type, "content": text, "truncated": truncated, "cached": cached}
 
     # -------------------------
     # Unsupported binary formats
@@ -97,15 +370,385 @@ def read_drive_file(file_id: str) -> dict:
         "type": mime_type,
         "content": "(Binary file cannot be previewed)"
     }
-    
+
+
+#local content index
+# Queued files the background indexer takes per pass
+DRIVE_INDEX_BATCH = int(os.getenv("DRIVE_INDEX_BATCH", "20"))
+# Most recently modified files queued when the index is first built
+DRIVE_INDEX_BOOTSTRAP_FILES = int(os.getenv("DRIVE_INDEX_BOOTSTRAP_FILES", "200"))
+# Failed attempts after which a queued file is dropped until it changes again
+DRIVE_INDEX_MAX_ATTEMPTS = int(os.getenv("DRIVE_INDEX_MAX_ATTEMPTS", "5"))
+# Minimum interval between changes().list polls
+DRIVE_INDEX_SYNC_SECONDS = float(os.getenv("DRIVE_INDEX_SYNC_SECONDS", "60"))
+# Sheet rows per indexed chunk
+SHEET_INDEX_ROWS = 50
+DRIVE_INDEX_CHANGE_FIELDS = "nextPageToken, newStartPageToken, changes(fileId, removed, file(mimeType, trashed))"
+
+_content_index: ContentIndex | None = None
+_content_index_lock = threading.Lock()
+# Serialises changes().list syncs between concurrent searches
+_content_sync_lock = threading.Lock()
+# At most one background indexer; it drains the pending queue
+_indexer_lock = threading.Lock()
+_indexer_thread: threading.Thread | None = None
+_indexer_errors: list[dict] = []
+
+def get_content_index() -> ContentIndex:
+    """Return the process-wide Drive content index."""
+    global _content_index
+    with _content_index_lock:
+        if _content_index is None:
+            _content_index = ContentIndex()
+        return _content_index
+
+
+def _indexable(mime_type: str | None) -> bool:
+    return bool(mime_type) and (
+        mime_type in ("application/vnd.google-apps.document",
+                      "application/vnd.google-apps.spreadsheet",
+                      "application/pdf",
+                      "application/json")
+        or mime_type.startswith("text/")
+    )
+
+
+def _document_chunks(service, file_id: str, file: dict) -> list[tuple[str, str]]:
+    """
+    (location, text) chunks of a file's full text, extracted through the
+    same caches read_drive_file() uses. Locations name PDF pages and sheet
+    row ranges so results can be read back with start_page / offset.
+    """
+    mime_type = file["mimeType"]
+    revision = revision_of(file)
+
+    if mime_type in ("application/vnd.google-apps.spreadsheet", "text/csv"):
+        table, _ = _cached_table(service, file_id, revision, mime_type)
+        header = ", ".join(table.columns)
+        chunks = []
+        for start in range(0, len(table.rows), SHEET_INDEX_ROWS):
+            rows = table.rows[start:start + SHEET_INDEX_ROWS]
+            text = "\n".join([header] + [", ".join(row) for row in rows])
+            chunks.append((f"rows {start}-{start + len(rows) - 1}", text))
+        return chunks
+
+    if mime_type == "application/pdf":
+        key = ExtractionCache.key(file_id, revision, "application/pdf")
+        pages = _PdfPages(service, file_id, extraction_cache.get(key))
+        try:
+            chunks = [(f"page {i + 1}", pages.text(i)) for i in range(pages.total_pages())]
+        finally:
+            pages.close()
+        if pages.parsed:
+            extraction_cache.put(key, pages.to_cache())
+        return chunks
+
+    if mime_type == "application/vnd.google-apps.document":
+        text, _ = _cached_text(
+            file_id, revision, "text/plain",
+            lambda: execute(service.files().export(fileId=file_id, mimeType="text/plain"))
+        )
+    else:
+        text, _ = _cached_text(
+            file_id, revision, mime_type,
+            lambda: execute(service.files().get_media(fileId=file_id))
+        )
+    return chunk_text(text)
+
+
+def index_drive_file(file_id: str, service=None, file: dict | None = None) -> int:
+    """
+    (Re)index one Drive file; returns the number of chunks indexed.
+
+    Trashed and unsupported files are dropped from the index.
+    """
+    service = service or get_drive_service()
+    if file is None:
+        file = execute(service.files().get(
+            fileId=file_id, fields="name,mimeType,modifiedTime,md5Checksum,trashed"
+        ))
+    index = get_content_index()
+    if file.get("trashed") or not _indexable(file.get("mimeType")):
+        index.delete(file_id)
+        return 0
+    chunks = _document_chunks(service, file_id, file)
+    return index.put(file_id, file.get("name"), file["mimeType"], revision_of(file), chunks)
+
+
+def _keep_indexed(service, file_id: str, file: dict) -> None:
+    """Index a file read by read_drive_file() if the index has an older revision."""
+    index = get_content_index()
+    if index.revision(file_id) == revision_of(file):
+        return
+    if file["mimeType"] == "application/pdf":
+        # Indexing needs every page; leave that to the next sync instead of
+        # parsing the whole PDF when only a few pages were asked for
+        index.queue([file_id])
+    else:
+        index_drive_file(file_id, service, file)
+
+
+def sync_content_index(service=None, force: bool = False) -> dict:
+    """
+    Queue the Drive files whose indexed text is out of date.
+
+    Changed files are found through changes().list from the stored page
+    token (one cheap call when nothing changed). The first sync queues the
+    most recently modified files instead. Nothing is downloaded here; see
+    start_background_indexing().
+
+    Returns:
+        dict: {"mode": "fresh" | "delta" | "bootstrap", "queued": int}
+    """
+    index = get_content_index()
+    with _content_sync_lock:
+        service = service or get_drive_service()
+        mode = "fresh"
+        queued = 0
+
+        if index.page_token is None:
+            # Take the token first so changes made while bootstrapping are not lost
+            token = execute(service.changes().getStartPageToken())["startPageToken"]
+            ids = []
+            for files, _ in iter_drive_pages(service, query="trashed = false", page_size=MAX_PAGE_SIZE,
+                                             fields="nextPageToken, files(id, mimeType)"):
+                ids += [f["id"] for f in files if _indexable(f["mimeType"])]
+                if len(ids) >= DRIVE_INDEX_BOOTSTRAP_FILES:
+                    break
+            ids = ids[:DRIVE_INDEX_BOOTSTRAP_FILES]
+            index.queue(ids)
+            index.page_token = token
+            index.synced_at = time.time()
+            mode, queued = "bootstrap", len(ids)
+
+        elif force or time.time() - index.synced_at >= DRIVE_INDEX_SYNC_SECONDS:
+            token = index.page_token
+            while token:
+                resp = execute(service.changes().list(
+                    pageToken=token, pageSize=1000, fields=DRIVE_INDEX_CHANGE_FIELDS
+                ))
+                changed = []
+                for change in resp.get("changes", []):
+                    file = change.get("file") or {}
+                    if change.get("removed") or file.get("trashed"):
+                        index.delete(change["fileId"])
+                    elif _indexable(file.get("mimeType")):
+                        changed.append(change["fileId"])
+                index.queue(changed)
+                queued += len(changed)
+                if resp.get("newStartPageToken"):
+                    index.page_token = resp["newStartPageToken"]
+                    break
+                token = resp.get("nextPageToken")
+                if token:
+                    # Persist progress so a failure mid-way does not replay pages
+                    index.page_token = token
+            index.synced_at = time.time()
+            mode = "delta"
+
+        return {"mode": mode, "queued": queued}
+
+
+def index_pending(service=None, limit: int = DRIVE_INDEX_BATCH) -> dict:
+    """
+    Download and index up to `limit` queued files, oldest first.
+
+    A file that fails goes to the back of the queue, so one bad file (a
+    corrupt PDF, a flaky export) never blocks the rest. Permanent failures
+    and files that failed DRIVE_INDEX_MAX_ATTEMPTS times are unqueued.
+
+    Returns:
+        dict: {"indexed": int, "errors": [{"file_id", "error"}, ...]}
+    """
+    index = get_content_index()
+    service = service or get_drive_service()
+    indexed = 0
+    errors = []
+    for file_id in index.pending(limit):
+        try:
+            index_drive_file(file_id, service)
+            indexed += 1
+        except Exception as error:
+            if isinstance(error, HttpError) and error.resp.status == 404:
+                index.delete(file_id)
+                continue
+            # Permanent failure (e.g. export too large); don't retry forever
+            permanent = isinstance(error, HttpError) and error.resp.status < 500 and error.resp.status != 429
+            if permanent or index.defer(file_id) >= DRIVE_INDEX_MAX_ATTEMPTS:
+                index.unqueue(file_id)
+            metrics.log_event("drive_index_error", file_id=file_id, error=str(error))
+            errors.append({"file_id": file_id, "error": str(error)})
+    return {"indexed": indexed, "errors": errors}
+
+
+def _drain_pending() -> None:
+    global _indexer_errors
+    try:
+        while True:
+            result = index_pending()
+            _indexer_errors = result["errors"]
+            if not result["indexed"]:
+                # Queue empty, or only files failing transiently; a later
+                # search starts another pass
+                return
+    except Exception as e:
+        _indexer_errors = [{"error": str(e)}]
+        metrics.log_event("drive_index_error", error=str(e))
+
+
+def start_background_indexing() -> bool:
+    """Start draining the pending queue in a daemon thread; True if one is running."""
+    global _indexer_thread
+    with _indexer_lock:
+        if _indexer_thread is None or not _indexer_thread.is_alive():
+            if not get_content_index().stats()["pending"]:
+                return False
+            _indexer_thread = threading.Thread(target=_drain_pending, name="drive-indexer", daemon=True)
+            _indexer_thread.start()
+        return True
+
+
+def search_drive_content(query: str, k: int = 5) -> dict:
+    """
+    Search the text of Drive documents in the local full-text index.
+
+    Syncs the list of changed files first (cheap when nothing changed) and
+    runs one BM25 query over what is indexed now. Queued files are
+    downloaded and indexed by a background thread, so a search never waits
+    on them; they show up in later searches.
+
+    Args:
+        query (str): Words to look for.
+        k (int): Maximum number of results.
+
+    Returns:
+        dict: {"results": [{file_id, name, location, score, snippet}],
+               "indexed_documents": int, "pending": int, "indexing": bool,
+               "errors": [...]}
+    """
+    sync_content_index()
+    indexing = start_background_indexing()
+    index = get_content_index()
+    results = index.search(query, max(1, min(k, 50)))
+    stats = index.stats()
+    return {
+        "results": results,
+        "indexed_documents": stats["documents"],
+        "pending": stats["pending"],
+        "indexing": indexing,
+        "errors": list(_indexer_errors),
+    }
+
 
 #download file content
 ATTACHMENTS_DIR = "attachments"
+# Total size the attachments cache may grow to before old downloads are evicted
+ATTACHMENTS_MAX_BYTES = int(os.getenv("ATTACHMENTS_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Files used this recently are never evicted: a path just returned by
+# download_drive_file() is typically attached to an email right after
+ATTACHMENTS_MIN_AGE_SECONDS = float(os.getenv("ATTACHMENTS_MIN_AGE_SECONDS", "600"))
+
+# One lock per (file_id, revision) so concurrent requests share one download.
+# Entries are [lock, users] and are dropped once nobody waits on the lock.
+_download_locks: dict[str, list] = {}
+_download_locks_guard = threading.Lock()
+
+@contextmanager
+def _download_lock(key: str, blocking: bool = True):
+    """Hold the download lock of `key`; yields False if `blocking` is off and it is taken."""
+    with _download_locks_guard:
+        entry = _download_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    acquired = entry[0].acquire(blocking)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            entry[0].release()
+        with _download_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _download_locks[key]
+
+
+def _md5_of(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _evict_attachments(keep: str) -> None:
+    """
+    Delete least recently used downloads until the cache fits ATTACHMENTS_MAX_BYTES.
+
+    Revisions whose download lock is held and files used within
+    ATTACHMENTS_MIN_AGE_SECONDS are left alone. Temp files (*.part) that old
+    with no download holding their lock were left by a crash and are always
+    deleted.
+    """
+    files = []
+    stale_parts = []
+    total = 0
+    now = time.time()
+    for root, _dirs, names in os.walk(ATTACHMENTS_DIR):
+        for fname in names:
+            path = os.path.join(root, fname)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            if now - stat.st_mtime < ATTACHMENTS_MIN_AGE_SECONDS:
+                continue
+            if fname.endswith(".part"):
+                stale_parts.append((stat.st_mtime, stat.st_size, path))
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+    for _mtime, size, path in stale_parts:
+        if _remove_unlocked(path):
+            total -= size
+    if total <= ATTACHMENTS_MAX_BYTES:
+        return
+    for _mtime, size, path in sorted(files):
+        if os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        if not _remove_unlocked(path):
+            continue
+        total -= size
+        if total <= ATTACHMENTS_MAX_BYTES:
+            break
+
+
+def _remove_unlocked(path: str) -> bool:
+    """
+    Delete a cached download unless its revision's download lock is held.
+
+    The lock is held while deleting, so a concurrent download_drive_file()
+    can neither be mid-download nor hand out this path.
+    """
+    key = os.path.relpath(os.path.dirname(path), ATTACHMENTS_DIR).replace(os.sep, "/")
+    with _download_lock(key, blocking=False) as acquired:
+        if not acquired:
+            return False
+        try:
+            os.unlink(path)
+            os.removedirs(os.path.dirname(path))  # prune now-empty revision dirs
+        except OSError:
+            pass
+    return True
+
 
 def download_drive_file(file_id: str, filename: str) -> dict:
     """
     Download a Google Drive file locally if not already cached.
 
+    Files are cached under attachments/<file_id>/<revision>/<filename>, so a
+    new Drive revision is downloaded again instead of serving a stale copy.
+    Downloads go to a temp file that is checked against Drive's md5Checksum
+    and then renamed into place, so a crashed download is never served.
+
     Args:
         file_id (str): Google Drive file ID to download.
         filename (str): Desired local filename.
@@ -117,31 +760,54 @@ def download_drive_file(file_id: str, filename: str) -> dict:
             "cached": bool
         }
     """
-    # Ensure attachments directory exists
-    os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
+    service = get_drive_service()
+    file = execute(service.files().get(
+        fileId=file_id,
+        fields="modifiedTime,md5Checksum"
+    ))
+    revision = hashlib.sha256(revision_of(file).encode()).hexdigest()[:16]
 
-    file_path = os.path.join(ATTACHMENTS_DIR, filename)
+    # basename() keeps a model-supplied filename from escaping the cache dir
+    dir_path = os.path.join(ATTACHMENTS_DIR, file_id, revision)
+    file_path = os.path.join(dir_path, os.path.basename(filename))
 
-    # ✅ Check if file already downloaded locally
-    if os.path.exists(file_path):
-        return {
-            "file_id": file_id,
-            "path": file_path,
-            "cached": True
-        }
+    with _download_lock(f"{file_id}/{revision}"):
+        # ✅ Check if this revision is already downloaded locally
+        if os.path.exists(file_path):
+            os.utime(file_path)  # mark as recently used for eviction
+            return {
+                "file_id": file_id,
+                "path": file_path,
+                "cached": True
+            }
 
-    # ✅ Download from Drive (first time)
-    service = get_drive_service()
-    request = service.files().get_media(fileId=file_id)
-    fh = io.FileIO(file_path, "wb")
-    downloader = MediaIoBaseDownload(fh, request)
+        # ✅ Download from Drive (first time for this revision)
+        os.makedirs(dir_path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix=".part")
+        try:
+            with io.FileIO(fd, "wb") as fh:
+                downloader = MediaIoBaseDownload(
+                    fh, service.files().get_media(fileId=file_id), chunksize=DOWNLOAD_CHUNK_SIZE
+                )
+                done = False
+                while done is False:
+                    throttle("drive.files.get")
+                    status, done = downloader.next_chunk(num_retries=MAX_ATTEMPTS - 1)
 
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
+            expected = file.get("md5Checksum")
+            if expected and _md5_of(tmp_path) != expected:
+                raise IOError(f"Checksum mismatch downloading Drive file {file_id}")
+
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    _evict_attachments(keep=file_path)
 
     return {
         "file_id": file_id,
         "path": file_path,
         "cached": False
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,149 @@
+"""
+Shared MIME composition for outgoing mail.
+
+send_email, reply_to_email and send_emails all build their messages here.
+Encoded attachment parts are cached by (path, mtime, size), so sending the
+same file to many recipients reads and base64-encodes it once. Messages
+whose attachments are too large to build in memory are written to a file
+object by write_streaming_message() instead.
+"""
+from __future__ import annotations
+
+import base64
+import mimetypes
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from email import encoders
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import encode_rfc2231
+
+# Total size of encoded attachment parts kept in memory
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 57 raw bytes encode to one 76-character base64 line; read many lines at once
+_B64_READ_SIZE = 57 * 1024
+
+
+def content_type_of(path: str) -> tuple[str, str]:
+    """(maintype, subtype) for a file, falling back to application/octet-stream."""
+    ctype, encoding = mimetypes.guess_type(path)
+    if ctype is None or encoding is not None:
+        ctype = "application/octet-stream"
+    maintype, subtype = ctype.split("/", 1)
+    return maintype, subtype
+
+
+def _disposition(filename: str) -> str:
+    if filename.isascii():
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename*={encode_rfc2231(filename, 'utf-8')}"
+
+
+class AttachmentCache:
+    """LRU cache of encoded attachment parts, bounded by total encoded size."""
+
+    def __init__(self, max_bytes: int = ATTACHMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._parts: OrderedDict[tuple, tuple[MIMEBase, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def part(self, path: str) -> MIMEBase:
+        """Return the encoded MIME part for `path`, re-encoding only if the file changed."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._parts.get(key)
+            if cached is not None:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        maintype, subtype = content_type_of(path)
+        part = MIMEBase(maintype, subtype)
+        with open(path, "rb") as f:
+            part.set_payload(f.read())
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", _disposition(os.path.basename(path)))
+        size = len(part.get_payload())
+
+        with self._lock:
+            if size <= self.max_bytes and key not in self._parts:
+                self._parts[key] = (part, size)
+                self._size += size
+                while self._size > self.max_bytes:
+                    _key, (_part, old_size) = self._parts.popitem(last=False)
+                    self._size -= old_size
+        return part
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._parts), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+attachment_cache = AttachmentCache()
+
+
+def build_message(headers: dict, body: str, attachment_paths: list[str] | None = None) -> MIMEMultipart:
+    """
+    Build a multipart message with a plain-text body and any attachments.
+
+    `headers` maps header names (To, Subject, In-Reply-To, ...) to values;
+    None values are skipped.
+    """
+    message = MIMEMultipart()
+    for name, value in headers.items():
+        if value is not None:
+            message[name] = value
+    message.attach(MIMEText(body, "plain"))
+    for path in attachment_paths or []:
+        message.attach(attachment_cache.part(path))
+    return message
+
+
+def _encode_header(value: str) -> str:
+    return value if value.isascii() else Header(value, "utf-8").encode()
+
+
+def write_streaming_message(fh, headers: dict, body: str, attachment_paths: list[str]) -> None:
+    """
+    Write the same message as build_message() to the binary file object `fh`.
+
+    Attachments are read and base64-encoded in small blocks, so memory use
+    stays flat no matter how large the files are.
+    """
+    boundary = f"==============={uuid.uuid4().hex}=="
+
+    def write(text: str) -> None:
+        fh.write(text.encode("utf-8"))
+
+    write("MIME-Version: 1.0\n")
+    write(f'Content-Type: multipart/mixed; boundary="{boundary}"\n')
+    for name, value in headers.items():
+        if value is not None:
+            write(f"{name}: {_encode_header(value)}\n")
+    write("\n")
+
+    # Body text (small, so the regular email package is fine here)
+    write(f"--{boundary}\n")
+    fh.write(MIMEText(body, "plain").as_bytes())
+    write("\n")
+
+    for path in attachment_paths:
+        maintype, subtype = content_type_of(path)
+        write(f"--{boundary}\n")
+        write(f"Content-Type: {maintype}/{subtype}\n")
+        write("Content-Transfer-Encoding: base64\n")
+        write(f"Content-Disposition: {_disposition(os.path.basename(path))}\n")
+        write("\n")
+        with open(path, "rb") as src:
+            for block in iter(lambda: src.read(_B64_READ_SIZE), b""):
+                fh.write(base64.encodebytes(block))
+    write(f"--{boundary}--\n")
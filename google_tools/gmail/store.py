@@ -0,0 +1,279 @@
+"""
+Local SQLite cache of parsed Gmail messages.
+
+Messages are stored once, keyed by Gmail message ID, with their parsed
+headers, extracted body, thread ID and labels. The store also keeps the
+Gmail historyId it was last synced to, so callers only have to ask Gmail
+for what changed since then (users().history().list) instead of listing
+and downloading the inbox again.
+
+This module only depends on the standard library so it can be imported
+both by the MCP tool server and by email_listner.py.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+STORE_PATH = Path(os.getenv("GMAIL_STORE_PATH", Path(__file__).parent / "message_store.sqlite3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    message_id_header TEXT,
+    snippet TEXT,
+    body TEXT,
+    label_ids TEXT NOT NULL DEFAULT '[]',
+    internal_date INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_internal_date ON messages(internal_date);
+CREATE INDEX IF NOT EXISTS messages_thread_id ON messages(thread_id);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_COLUMNS = ("id", "thread_id", "subject", "sender", "date", "message_id_header",
+            "snippet", "body", "label_ids", "internal_date")
+
+
+class MessageStore:
+    """Thread-safe wrapper around the SQLite message cache."""
+
+    def __init__(self, path: Path | str = STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            # WAL lets the listener process write while the tool server reads
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- messages ----------
+
+    def get(self, message_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM messages WHERE id = ?", (message_id,)
+            ).fetchone()
+        return _row_to_record(row) if row else None
+
+    def has(self, message_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM messages WHERE id = ?", (message_id,)
+            ).fetchone()
+        return row is not None
+
+    def missing(self, message_ids: list[str]) -> list[str]:
+        """Return the IDs from `message_ids` that are not cached yet, in order."""
+        if not message_ids:
+            return []
+        with self._lock:
+            placeholders = ",".join("?" * len(message_ids))
+            rows = self._conn.execute(
+                f"SELECT id FROM messages WHERE id IN ({placeholders})", message_ids
+            ).fetchall()
+        cached = {row["id"] for row in rows}
+        return [m for m in message_ids if m not in cached]
+
+    def put(self, record: dict) -> None:
+        """Insert or replace a parsed message record (see gmail.tools._parse_message)."""
+        values = (
+            record["id"],
+            record["thread_id"],
+            record.get("subject"),
+            record.get("from"),
+            record.get("date"),
+            record.get("message_id_header"),
+            record.get("snippet"),
+            record.get("body"),
+            json.dumps(record.get("label_ids", [])),
+            int(record.get("internal_date") or 0),
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO messages ({','.join(_COLUMNS)}) "
+                f"VALUES ({','.join('?' * len(_COLUMNS))})",
+                values,
+            )
+
+    def set_labels(self, message_id: str, label_ids: list[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE messages SET label_ids = ? WHERE id = ?",
+                (json.dumps(label_ids), message_id),
+            )
+
+    def delete(self, message_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    def latest(self, label: str = "INBOX", exclude_label: Optional[str] = "SENT") -> Optional[dict]:
+        """Return the newest cached message carrying `label` and not `exclude_label`."""
+        query = "SELECT * FROM messages WHERE label_ids LIKE ?"
+        params: list = [f'%"{label}"%']
+        if exclude_label:
+            query += " AND label_ids NOT LIKE ?"
+            params.append(f'%"{exclude_label}"%')
+        query += " ORDER BY internal_date DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return _row_to_record(row) if row else None
+
+    def thread(self, thread_id: str) -> list[dict]:
+        """Return the cached messages of a thread, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM messages WHERE thread_id = ? ORDER BY internal_date",
+                (thread_id,),
+            ).fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    # ---------- sync state ----------
+
+    def _get_state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_state(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    @property
+    def history_id(self) -> Optional[int]:
+        """historyId the cached messages are in sync with (None before the first sync)."""
+        value = self._get_state("history_id")
+        return int(value) if value else None
+
+    @history_id.setter
+    def history_id(self, value: int | str) -> None:
+        self._set_state("history_id", str(value))
+
+    def record_notification(self, history_id: int | str) -> None:
+        """
+        Remember the historyId carried by a Gmail Pub/Sub notification.
+
+        Called by the listener. While the store is at or past the latest
+        notified historyId there is nothing new on the server, so readers
+        can skip the history().list round trip entirely.
+        """
+        current = self._get_state("notified_history_id")
+        if current is None or int(history_id) >= int(current):
+            self._set_state("notified_history_id", str(history_id))
+        self._set_state("notified_at", str(time.time()))
+
+    def is_fresh(self, max_age: float) -> bool:
+        """True if a notification seen within `max_age` seconds says we're up to date."""
+        notified = self._get_state("notified_history_id")
+        notified_at = self._get_state("notified_at")
+        synced = self.history_id
+        if notified is None or notified_at is None or synced is None:
+            return False
+        if time.time() - float(notified_at) > max_age:
+            return False
+        return synced >= int(notified)
+
+
+def _row_to_record(row: sqlite3.Row) -> dict:
+    return {
+        "id": row["id"],
+        "thread_id": row["thread_id"],
+        "subject": row["subject"],
+        "from": row["sender"],
+        "date": row["date"],
+        "message_id_header": row["message_id_header"],
+        "snippet": row["snippet"],
+        "body": row["body"],
+        "label_ids": json.loads(row["label_ids"]),
+        "internal_date": row["internal_date"],
+    }
+
+
+def _execute(request):
+    return request.execute()
+
+
+def fetch_history_delta(service, start_history_id: int | str, label_id: Optional[str] = None,
+                        execute=_execute) -> dict:
+    """
+    Ask Gmail what changed since `start_history_id`.
+
+    `execute` runs each API request; the tool server passes its retrying,
+    rate-limited executor (utils.retry.execute).
+
+    Returns:
+        dict: {
+            "history_id": int,                  # new checkpoint to store
+            "added": [message_id, ...],         # in the order Gmail reported them
+            "threads": {message_id: thread_id},  # thread of each added message
+            "deleted": [message_id, ...],
+            "labels": {message_id: [label_id, ...]}  # current labels after label changes
+        }
+
+    Raises googleapiclient.errors.HttpError (404) when `start_history_id` is
+    too old; callers should fall back to a full resync.
+    """
+    added: list[str] = []
+    seen_added: set[str] = set()
+    threads: dict[str, str] = {}
+    deleted: list[str] = []
+    labels: dict[str, list[str]] = {}
+    history_id = int(start_history_id)
+    page_token = None
+
+    while True:
+        resp = execute(service.users().history().list(
+            userId="me",
+            startHistoryId=str(start_history_id),
+            labelId=label_id,
+            pageToken=page_token,
+        ))
+
+        for record in resp.get("history", []):
+            for item in record.get("messagesAdded", []):
+                msg = item["message"]
+                if msg["id"] not in seen_added:
+                    seen_added.add(msg["id"])
+                    added.append(msg["id"])
+                    threads[msg["id"]] = msg.get("threadId")
+                labels[msg["id"]] = msg.get("labelIds", [])
+            for item in record.get("messagesDeleted", []):
+                deleted.append(item["message"]["id"])
+            for key in ("labelsAdded", "labelsRemoved"):
+                for item in record.get(key, []):
+                    msg = item["message"]
+                    labels[msg["id"]] = msg.get("labelIds", [])
+
+        history_id = max(history_id, int(resp.get("historyId", history_id)))
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+
+    deleted_set = set(deleted)
+    return {
+        "history_id": history_id,
+        "added": [m for m in added if m not in deleted_set],
+        "threads": {m: t for m, t in threads.items() if m not in deleted_set},
+        "deleted": deleted,
+        "labels": {m: l for m, l in labels.items() if m not in deleted_set},
+    }
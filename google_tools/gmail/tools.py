@@ -1,17 +1,19 @@
-from auth.auth import get_gmail_service,get_credentials
-import email
+from auth.auth import get_gmail_service
 import base64
 from utils.util import strip_html_tags
-from email.mime.text import MIMEText
+from utils.retry import execute, cost_of, is_retryable, backoff_delay, MAX_ATTEMPTS, GMAIL_UNITS_PER_SECOND
+from gmail.store import MessageStore, fetch_history_delta
+from gmail.compose import build_message, write_streaming_message
 from base64 import urlsafe_b64encode
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
 
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-from base64 import urlsafe_b64encode
+from email.utils import make_msgid
 import os
-from googleapiclient.discovery import build
+import re
+import tempfile
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path="agent/.env")
@@ -19,89 +21,739 @@ load_dotenv(dotenv_path="agent/.env")
 #Tools
 def list_labels() -> list[str]:
     service = get_gmail_service()
-    resp = service.users().labels().list(userId="me").execute()
+    resp = execute(service.users().labels().list(userId="me"))
     return [label["name"] for label in resp.get("labels", [])]
 
+#message parsing helpers
+def _header_map(msg: dict) -> dict[str, str]:
+    """
+    Headers of a message keyed by lower-cased name, built in one pass
+    (header names vary in case, e.g. Message-Id vs Message-ID).
+    """
+    return {h["name"].lower(): h["value"] for h in msg.get("payload", {}).get("headers", [])}
+
+
+def _iter_parts(payload: dict):
+    """Yield every MIME part of a format="full" payload tree, depth-first in document order."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        yield part
+        # reversed so the first child is visited first
+        stack.extend(reversed(part.get("parts", [])))
+
+
+def _part_charset(part: dict) -> str:
+    for h in part.get("headers", []):
+        if h["name"].lower() == "content-type":
+            for param in h["value"].split(";")[1:]:
+                key, _, value = param.strip().partition("=")
+                if key.lower() == "charset" and value:
+                    return value.strip('"')
+    return "utf-8"
+
+
+def _find_body_part(payload: dict) -> dict | None:
+    """
+    Pick the part that holds the readable body.
+
+    Returns the first usable text/plain part, otherwise the first usable
+    text/html part. Empty parts (neither inline data nor an attachmentId)
+    are skipped, so an empty plain alternative doesn't hide the HTML one.
+    Parts with a filename are attachments and are never considered, so
+    their data is neither fetched nor decoded.
+    """
+    first_html = None
+    for part in _iter_parts(payload):
+        if part.get("filename"):
+            continue
+        body = part.get("body", {})
+        if not body.get("data") and not body.get("attachmentId"):
+            continue
+        mime_type = part.get("mimeType", "")
+        if mime_type == "text/plain":
+            return part
+        if mime_type == "text/html" and first_html is None:
+            first_html = part
+    return first_html
+
+
+def _extract_body(service, msg: dict) -> str:
+    """Decode the body text straight from the already-fetched payload tree."""
+    payload = msg.get("payload", {})
+    part = _find_body_part(payload)
+    if part is None:
+        return ""
+
+    part_body = part.get("body", {})
+    data = part_body.get("data")
+    if not data and part_body.get("attachmentId"):
+        # Gmail moves very large text parts out of line; fetch just that part
+        data = execute(service.users().messages().attachments().get(
+            userId="me",
+            messageId=msg["id"],
+            id=part_body["attachmentId"]
+        )).get("data")
+    if not data:
+        return ""
+
+    charset = _part_charset(part)
+    try:
+        text = base64.urlsafe_b64decode(data).decode(charset, errors="ignore")
+    except LookupError:  # unknown charset name
+        text = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
+
+    if part.get("mimeType") == "text/html":
+        text = strip_html_tags(text)
+    return text
+
+
+def _parse_message(service, msg: dict) -> dict:
+    """Turn a format="full" message into the record kept in the message store."""
+    headers = _header_map(msg)
+    return {
+        "id": msg["id"],
+        "thread_id": msg["threadId"],
+        "subject": headers.get("subject", "(No Subject)"),
+        "from": headers.get("from", "(Unknown Sender)"),
+        "date": headers.get("date"),
+        "message_id_header": headers.get("message-id"),
+        "snippet": msg.get("snippet", ""),
+        "body": _extract_body(service, msg),
+        "label_ids": msg.get("labelIds", []),
+        "internal_date": int(msg.get("internalDate", 0)),
+    }
+
+
+# Gmail accepts at most 100 calls per HTTP batch request.
+BATCH_SIZE = 100
+
+def _batch_get(service, ids: list[str], **get_params) -> tuple[dict[str, dict], list[dict]]:
+    """
+    Fetch messages with Gmail HTTP batch requests.
+
+    `get_params` are extra messages().get arguments; the default is
+    format="full".
+
+    Parts that fail with a retryable error (429/5xx) are re-batched after a
+    backoff; anything else is reported.
+
+    Returns ({message_id: message}, [{"id": ..., "error": ...}, ...]).
+    """
+    fetched: dict[str, dict] = {}
+    errors: list[dict] = []
+    retry: list[str] = []
+    last_error: dict[str, Exception] = {}
+
+    def _on_message(request_id, response, exception):
+        if exception is None:
+            fetched[request_id] = response
+        elif is_retryable(exception):
+            retry.append(request_id)
+            last_error[request_id] = exception
+        else:
+            errors.append({"id": request_id, "error": str(exception)})
+
+    get_params.setdefault("format", "full")
+    pending = list(ids)
+    for attempt in range(MAX_ATTEMPTS):
+        for start in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[start:start + BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=_on_message)
+            for msg_id in chunk:
+                batch.add(
+                    service.users().messages().get(userId="me", id=msg_id, **get_params),
+                    request_id=msg_id,
+                )
+            try:
+                execute(batch, cost=len(chunk) * cost_of("gmail.users.messages.get"))
+            except HttpError as error:
+                # The whole batch failed; report every message in it and carry on
+                errors.extend(
+                    {"id": msg_id, "error": str(error)}
+                    for msg_id in chunk
+                    if msg_id not in fetched
+                )
+
+        if not retry:
+            break
+        pending, retry = retry, []
+        if attempt < MAX_ATTEMPTS - 1:
+            time.sleep(backoff_delay(attempt, last_error.get(pending[0])))
+    else:
+        errors.extend({"id": msg_id, "error": str(last_error[msg_id])} for msg_id in pending)
+
+    return fetched, errors
+
+
+def _fetch_into_store(service, store: MessageStore, ids: list[str]) -> list[dict]:
+    """Download and parse the given messages into the store; return the errors."""
+    fetched, errors = _batch_get(service, ids)
+    for msg_id, msg in fetched.items():
+        try:
+            store.put(_parse_message(service, msg))
+        except Exception as e:
+            errors.append({"id": msg_id, "error": str(e)})
+    return errors
+
+
+#local message store
+# How many recent inbox messages to pull in when the store is empty or its
+# historyId has expired.
+STORE_BOOTSTRAP_SIZE = int(os.getenv("GMAIL_STORE_BOOTSTRAP_SIZE", "50"))
+# Trust a Pub/Sub notification recorded by the listener for this long; while
+# the store is at or past its historyId no history().list call is needed.
+STORE_NOTIFY_TRUST_SECONDS = float(os.getenv("GMAIL_STORE_NOTIFY_TRUST_SECONDS", "300"))
+
+_message_store: MessageStore | None = None
+_message_store_lock = threading.Lock()
+
+def get_message_store() -> MessageStore:
+    """Return the process-wide message store."""
+    global _message_store
+    with _message_store_lock:
+        if _message_store is None:
+            _message_store = MessageStore()
+        return _message_store
+
+
+def sync_message_store(service=None, store: MessageStore | None = None) -> dict:
+    """
+    Bring the local message store up to date with Gmail.
+
+    Uses users().history().list from the stored historyId, so only new,
+    deleted or relabelled messages cost API calls. Falls back to fetching
+    the most recent inbox messages when there is no usable checkpoint.
+
+    The checkpoint only moves forward when every new message was stored;
+    otherwise the next sync asks for the same changes again and fetches
+    just the messages still missing.
+
+    Returns:
+        dict: {"mode": "fresh" | "delta" | "bootstrap", "added": int, "errors": [...]}
+    """
+    store = store or get_message_store()
+    if store.is_fresh(STORE_NOTIFY_TRUST_SECONDS):
+        return {"mode": "fresh", "added": 0, "errors": []}
+
+    service = service or get_gmail_service()
+
+    if store.history_id is not None:
+        try:
+            delta = fetch_history_delta(service, store.history_id, execute=execute)
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            # historyId too old (Gmail keeps roughly a week); resync below
+        else:
+            for msg_id in delta["deleted"]:
+                store.delete(msg_id)
+            errors = _fetch_into_store(service, store, store.missing(delta["added"]))
+            for msg_id, label_ids in delta["labels"].items():
+                store.set_labels(msg_id, label_ids)
+            if not errors:
+                store.history_id = delta["history_id"]
+            return {"mode": "delta", "added": len(delta["added"]), "errors": errors}
+
+    # Bootstrap: take the checkpoint first so nothing arriving meanwhile is lost
+    history_id = execute(service.users().getProfile(userId="me"))["historyId"]
+    result = execute(service.users().messages().list(
+        userId="me", maxResults=STORE_BOOTSTRAP_SIZE, labelIds=["INBOX"]
+    ))
+    ids = [m["id"] for m in result.get("messages", [])]
+    errors = _fetch_into_store(service, store, store.missing(ids))
+    if not errors:
+        store.history_id = history_id
+    return {"mode": "bootstrap", "added": len(ids), "errors": errors}
+
+
+#body normalisation
+# Rough chars-per-token ratio for English mail; close enough for budgeting
+CHARS_PER_TOKEN = 4
+BODY_TOKEN_BUDGET = int(os.getenv("GMAIL_BODY_TOKEN_BUDGET", "1500"))
+# Per-message budget when many emails are returned at once
+READ_EMAILS_TOKEN_BUDGET = int(os.getenv("GMAIL_READ_EMAILS_TOKEN_BUDGET", "500"))
+TRUNCATION_MARKER = "\n[... truncated ...]"
+
+# A year, a clock time or an email address
+_HEADER_SHAPE = r"(?:\b(?:19|20)\d\d\b|\b\d{1,2}:\d\d\b|\S@\w)"
+# Everything from the first match on is history/signature, not new content
+_HISTORY_START = re.compile(
+    # Gmail/Apple reply header: "On <date or address> ... wrote:" over at most
+    # two lines, with a year, a time or an address before "wrote:", then the
+    # quoted "> " block itself
+    r"^On\b(?:[^\n]*?" + _HEADER_SHAPE + r"[^\n]*(?:\n[^\n]*)?|[^\n]*\n[^\n]*?" + _HEADER_SHAPE + r"[^\n]*)"
+    r"\bwrote:[ \t]*\n(?:[ \t]*\n)*[ \t]*>"
+    r"|^-{2,}[ \t]*(?:Original Message|Forwarded message)[ \t]*-{2,}"      # Outlook / Gmail forward
+    r"|^Begin forwarded message:"
+    r"|^_{10,}[ \t]*\n(?:From|De|Von):"                                     # Outlook separator line
+    r"|^From:[^\n]*\n(?:Sent|Date):[^\n]*\n(?:To|Cc|Subject):"               # Outlook header block
+    r"|^-- $"                                                               # RFC 3676 signature delimiter
+    r"|^Sent from my [^\n]*$"
+    r"|^Get Outlook for [^\n]*$",
+    re.MULTILINE | re.IGNORECASE,
+)
+_QUOTED_LINE = re.compile(r"^[ \t]*>[^\n]*\n?", re.MULTILINE)
+_EXTRA_BLANK_LINES = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)+")
+
+
+def _trim_to_budget(text: str, token_budget: int) -> tuple[str, bool]:
+    """Cut `text` at a word boundary to about `token_budget` tokens (0 = no limit)."""
+    max_chars = token_budget * CHARS_PER_TOKEN
+    if token_budget <= 0 or len(text) <= max_chars:
+        return text, False
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars] + TRUNCATION_MARKER, True
+
+
+def normalize_body(body: str, token_budget: int | None = None) -> dict:
+    """
+    Strip quoted replies, forwarded history and signatures, then trim the
+    body to `token_budget` tokens (approximate) with a visible marker.
+
+    If stripping would leave nothing (e.g. a bare forward), the history is
+    kept, since then it is the content.
+
+    Returns:
+        dict: {"body": str, "original_chars": int, "trimmed_chars": int,
+               "history_removed": bool, "truncated": bool}
+    """
+    budget = BODY_TOKEN_BUDGET if token_budget is None else token_budget
+    original_chars = len(body)
+    text = body.replace("\r\n", "\n")
+
+    history_removed = False
+    match = _HISTORY_START.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()]
+        history_removed = True
+    unquoted = _QUOTED_LINE.sub("", text)
+    if unquoted.strip() and unquoted != text:
+        text = unquoted
+        history_removed = True
+    text = _EXTRA_BLANK_LINES.sub("\n\n", text).strip()
+
+    text, truncated = _trim_to_budget(text, budget)
+
+    return {
+        "body": text,
+        "original_chars": original_chars,
+        "trimmed_chars": len(text),
+        "history_removed": history_removed,
+        "truncated": truncated,
+    }
+
+
+def _reply_view(msg: dict, token_budget: int | None) -> dict:
+    """Fields returned by read_latest_email()/read_email() for a stored message."""
+    normalized = normalize_body(msg["body"] or "", token_budget)
+    return {
+        "subject": msg["subject"],
+        "from": msg["from"],
+        "body": normalized["body"] or "(No body text)",
+        "thread_id": msg["thread_id"],
+        "message_id_header": msg["message_id_header"],
+        "body_stats": {k: v for k, v in normalized.items() if k != "body"},
+    }
+
+
 #read messages
-def read_latest_email() -> dict:
+def read_latest_email(token_budget: int | None = None) -> dict:
     """
     Fetch the most recent email with subject, sender, full body,
     and metadata needed to reply to the thread.
-    """
-    service = get_gmail_service()
 
-    # 1) Get the most recent message ID
-    result = service.users().messages().list(
-        userId="me", maxResults=20, q="in:inbox -label:sent"
-    ).execute()
+    Served from the local message store after a cheap incremental sync,
+    so reading the same email again costs no Gmail downloads. The body has
+    quoted history and signatures removed and is trimmed to `token_budget`
+    (default GMAIL_BODY_TOKEN_BUDGET); "body_stats" reports the savings.
+    """
+    store = get_message_store()
+    sync_message_store(store=store)
 
-    messages = result.get("messages", [])
-    if not messages:
+    msg = store.latest(label="INBOX", exclude_label="SENT")
+    if msg is None:
         return {"error": "No emails found."}
 
-    msg_id = messages[0]["id"]
+    return _reply_view(msg, token_budget)
 
-    # 2) Get the full message metadata
-    msg = service.users().messages().get(
-        userId="me",
-        id=msg_id,
-        format="full"
-    ).execute()
-
-    # 3) Extract headers
-    headers = msg["payload"]["headers"]
-    subject = next((h["value"] for h in headers if h["name"] == "Subject"), "(No Subject)")
-    sender = next((h["value"] for h in headers if h["name"] == "From"), "(Unknown Sender)")
-    message_id_header = next((h["value"] for h in headers if h["name"] == "Message-ID"), None)
+def read_email(message_id: str, token_budget: int | None = None) -> dict:
+    """
+    Fetch one email by Gmail message ID, with the same fields as
+    read_latest_email(). Served from the local store when cached.
+    """
+    store = get_message_store()
+    msg = store.get(message_id)
+    if msg is None:
+        service = get_gmail_service()
+        try:
+            full = execute(service.users().messages().get(
+                userId="me", id=message_id, format="full"
+            ))
+        except HttpError as error:
+            return {"error": str(error)}
+        msg = _parse_message(service, full)
+        store.put(msg)
+
+    return _reply_view(msg, token_budget)
+
+#read many messages at once
+def read_emails(query: str = "in:inbox -label:sent", max_results: int = 20) -> dict:
+    """
+    Fetch up to `max_results` messages matching a Gmail search query.
 
-    # 4) Try different body formats
-    body = ""
-    raw_email = None  
+    Message IDs are listed first; messages already in the local store are
+    served from it and the rest are fetched with Gmail HTTP batch requests
+    (up to 100 per round trip) instead of one `messages().get` per message.
 
-    payload = msg.get("payload", {})
+    Args:
+        query (str): Gmail search query, e.g. "is:unread in:inbox".
+        max_results (int): Maximum number of messages to return.
 
-    # A) Inline plain text (simplest case)
-    if "body" in payload and payload["body"].get("data"):
-        body = base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8", errors="ignore")
+    Returns:
+        dict: {
+            "emails": [ {id, thread_id, subject, from, date, snippet,
+                         body, message_id_header}, ... ],
+            "errors": [ {"id": str, "error": str}, ... ]  # messages that failed
+        }
+    """
+    service = get_gmail_service()
+    store = get_message_store()
 
-    # B) Multipart → fallback to raw
-    if not body:
-        raw_msg = service.users().messages().get(
+    # 1) Collect message IDs (paginate if more than one page is requested)
+    ids: list[str] = []
+    page_token = None
+    while len(ids) < max_results:
+        result = execute(service.users().messages().list(
             userId="me",
-            id=msg["id"],
-            format="raw"
-        ).execute()
-        raw_email = base64.urlsafe_b64decode(raw_msg["raw"])
-
-        email_message = email.message_from_bytes(raw_email)
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    body = part.get_payload(decode=True).decode("utf-8", errors="ignore")
-                elif part.get_content_type() == "text/html":
-                    html_body = part.get_payload(decode=True).decode("utf-8", errors="ignore")
-                    body = strip_html_tags(html_body)
+            q=query,
+            maxResults=min(max_results - len(ids), 500),
+            pageToken=page_token,
+        ))
+        ids.extend(m["id"] for m in result.get("messages", []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            break
+    ids = ids[:max_results]
+
+    if not ids:
+        return {"emails": [], "errors": []}
+
+    # 2) Fetch only what the store doesn't have yet
+    errors = _fetch_into_store(service, store, store.missing(ids))
+
+    # 3) Build compact records in the original order
+    emails = []
+    for msg_id in ids:
+        msg = store.get(msg_id)
+        if msg is None:
+            continue
+        # Keep per-message bodies short so a backlog listing stays cheap in LLM context
+        normalized = normalize_body(msg["body"] or "", READ_EMAILS_TOKEN_BUDGET)
+        emails.append({
+            "id": msg["id"],
+            "thread_id": msg["thread_id"],
+            "subject": msg["subject"],
+            "from": msg["from"],
+            "date": msg["date"],
+            "snippet": msg["snippet"],
+            "body": normalized["body"] or "(No body text)",
+            "message_id_header": msg["message_id_header"],
+            "original_chars": normalized["original_chars"],
+            "trimmed_chars": normalized["trimmed_chars"],
+        })
+
+    return {"emails": emails, "errors": errors}
+
+#list messages (metadata only)
+LIST_METADATA_HEADERS = ["From", "Subject", "Date"]
+# Partial response: only what a listing shows, not the payload tree
+LIST_MESSAGE_FIELDS = "id,threadId,labelIds,snippet,payload/headers"
+
+def list_emails(query: str = "in:inbox", page_token: str | None = None, max_results: int = 25) -> dict:
+    """
+    List one page of messages with From/Subject/Date/snippet only, for triage.
+
+    Uses format="metadata" with a header projection and a `fields`
+    partial response, so no message bodies are downloaded or parsed.
+    Messages already in the local store are served from it.
+
+    Args:
+        query (str): Gmail search query, e.g. "is:unread in:inbox".
+        page_token (str, optional): next_page_token from the previous call.
+        max_results (int): Messages per page (max 100).
+
+    Returns:
+        dict: {
+            "emails": [ {id, thread_id, from, subject, date, snippet, unread}, ... ],
+            "next_page_token": str | None,
+            "errors": [ {"id": str, "error": str}, ... ]
+        }
+    """
+    service = get_gmail_service()
+    store = get_message_store()
+
+    result = execute(service.users().messages().list(
+        userId="me",
+        q=query,
+        maxResults=max(1, min(max_results, BATCH_SIZE)),
+        pageToken=page_token,
+        fields="messages(id),nextPageToken",
+    ))
+    ids = [m["id"] for m in result.get("messages", [])]
+    next_page_token = result.get("nextPageToken")
+
+    fetched, errors = _batch_get(
+        service, store.missing(ids),
+        format="metadata", metadataHeaders=LIST_METADATA_HEADERS, fields=LIST_MESSAGE_FIELDS,
+    )
+
+    emails = []
+    for msg_id in ids:
+        if msg_id in fetched:
+            msg = fetched[msg_id]
+            headers = _header_map(msg)
+            record = {
+                "thread_id": msg["threadId"],
+                "from": headers.get("from", "(Unknown Sender)"),
+                "subject": headers.get("subject", "(No Subject)"),
+                "date": headers.get("date"),
+                "snippet": msg.get("snippet", ""),
+                "label_ids": msg.get("labelIds", []),
+            }
+        else:
+            record = store.get(msg_id)
+            if record is None:
+                continue
+        emails.append({
+            "id": msg_id,
+            "thread_id": record["thread_id"],
+            "from": record["from"],
+            "subject": record["subject"],
+            "date": record["date"],
+            "snippet": record["snippet"],
+            "unread": "UNREAD" in record["label_ids"],
+        })
+
+    return {"emails": emails, "next_page_token": next_page_token, "errors": errors}
+
+
+#read a whole conversation
+# Newest messages of a thread that are shown with their body; older ones
+# are summarised by their snippet unless asked for by ID
+THREAD_FULL_BODIES = int(os.getenv("GMAIL_THREAD_FULL_BODIES", "3"))
+# Token budget shared by all bodies returned for one thread
+THREAD_TOKEN_BUDGET = int(os.getenv("GMAIL_THREAD_TOKEN_BUDGET", "3000"))
+THREAD_METADATA_HEADERS = ["From", "To", "Subject", "Date", "Message-ID"]
+# Paragraphs shorter than this ("Thanks!", "Hi Bob,") are never deduplicated
+_DEDUPE_MIN_CHARS = 40
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _dedupe_paragraphs(text: str, seen: set[str]) -> str:
+    """Drop paragraphs of `text` already shown earlier in the thread; record the rest."""
+    kept = []
+    for paragraph in _PARAGRAPH_SPLIT.split(text):
+        key = _WHITESPACE.sub(" ", paragraph).strip().lower()
+        if len(key) >= _DEDUPE_MIN_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(paragraph)
+    return "\n\n".join(kept).strip()
+
+
+def read_thread(thread_id: str, full_bodies: int = THREAD_FULL_BODIES,
+                message_ids: list[str] | None = None, token_budget: int | None = None) -> dict:
+    """
+    Return a compact, chronological view of a whole Gmail thread.
+
+    One threads().get(format="metadata") call lists every message with its
+    headers and snippet. Bodies are only needed for the newest
+    `full_bodies` messages (plus any in `message_ids`); those come from the
+    local message store or one batch request for the ones not cached.
+    Quoted history and signatures are stripped, paragraphs repeated from
+    earlier messages are dropped, and the bodies share `token_budget`.
+
+    Returns:
+        dict: {
+            "thread_id", "subject", "message_count", "participants": [...],
+            "messages": [{id, from, date, snippet | body, message_id_header}, ...],
+            "reply_to": {thread_id, message_id_header, from, subject} of the
+                        newest message not sent by us,
+            "original_chars", "trimmed_chars", "errors": [...]
+        }
+    """
+    service = get_gmail_service()
+    store = get_message_store()
+    budget = THREAD_TOKEN_BUDGET if token_budget is None else token_budget
+
+    thread = execute(service.users().threads().get(
+        userId="me",
+        id=thread_id,
+        format="metadata",
+        metadataHeaders=THREAD_METADATA_HEADERS,
+        fields="id,messages(id,labelIds,snippet,internalDate,payload/headers)",
+    ))
+    messages = sorted(thread.get("messages", []), key=lambda m: int(m.get("internalDate", 0)))
+    if not messages:
+        return {"error": f"Thread {thread_id} not found or empty."}
+
+    wanted = {m["id"] for m in messages[-full_bodies:]} if full_bodies > 0 else set()
+    wanted.update(message_ids or [])
+    wanted_in_order = [m["id"] for m in messages if m["id"] in wanted]
+    errors = _fetch_into_store(service, store, store.missing(wanted_in_order))
+    # A budget smaller than the number of bodies still trims each one (to one
+    # token); 0 would mean "no limit" to _trim_to_budget
+    per_message_budget = max(1, budget // len(wanted_in_order)) if wanted_in_order and budget > 0 else 0
+
+    seen: set[str] = set()
+    participants: list[str] = []
+    entries = []
+    original_chars = trimmed_chars = 0
+    reply_to = None
+    for msg in messages:
+        headers = _header_map(msg)
+        sender = headers.get("from", "(Unknown Sender)")
+        if sender not in participants:
+            participants.append(sender)
+        entry = {
+            "id": msg["id"],
+            "from": sender,
+            "date": headers.get("date"),
+            "message_id_header": headers.get("message-id"),
+        }
+        cached = store.get(msg["id"]) if msg["id"] in wanted else None
+        if cached is not None:
+            normalized = normalize_body(cached["body"] or "", 0)
+            body = _dedupe_paragraphs(normalized["body"], seen)
+            body, _ = _trim_to_budget(body, per_message_budget)
+            entry["body"] = body or "(No new text)"
+            original_chars += normalized["original_chars"]
+            trimmed_chars += len(body)
         else:
-            body = email_message.get_payload(decode=True).decode("utf-8", errors="ignore")
+            entry["snippet"] = msg.get("snippet", "")
+        entries.append(entry)
+        if "SENT" not in msg.get("labelIds", []):
+            reply_to = {
+                "thread_id": thread_id,
+                "message_id_header": headers.get("message-id"),
+                "from": sender,
+                "subject": headers.get("subject"),
+            }
 
     return {
-        "subject": subject,
-        "from": sender,
-        "body": body or "(No body text)",
-        "thread_id": msg["threadId"],             
-        "message_id_header": message_id_header      
+        "thread_id": thread_id,
+        "subject": _header_map(messages[0]).get("subject", "(No Subject)"),
+        "message_count": len(messages),
+        "participants": participants,
+        "messages": entries,
+        "reply_to": reply_to,
+        "original_chars": original_chars,
+        "trimmed_chars": trimmed_chars,
+        "errors": errors,
     }
-    
+
+
 #send email
-def send_email(to: str, subject: str, body: str, attachment_path: str = None) -> dict:
+# Domain of the Message-IDs stamped on outgoing mail; defaults to the
+# sender's own domain. Without one, make_msgid() resolves and leaks the
+# host's FQDN on every send.
+MESSAGE_ID_DOMAIN = os.getenv("GMAIL_MESSAGE_ID_DOMAIN")
+_sender_domain: str | None = None
+
+def _new_message_id(service) -> str:
+    """A fresh Message-ID header value in the sender's domain."""
+    global _sender_domain
+    domain = MESSAGE_ID_DOMAIN or _sender_domain
+    if domain is None:
+        address = execute(service.users().getProfile(userId="me"))["emailAddress"]
+        domain = _sender_domain = address.rpartition("@")[2]
+    return make_msgid(domain=domain)
+
+
+def _find_sent(service, message_id_header: str) -> dict | None:
+    """Look up a message we sent by its Message-ID header (used to make sends idempotent)."""
+    result = execute(service.users().messages().list(
+        userId="me", q=f"rfc822msgid:{message_id_header}", maxResults=1
+    ))
+    messages = result.get("messages", [])
+    return messages[0] if messages else None
+
+
+def _send_raw(service, message, thread_id: str | None = None) -> dict:
+    """
+    Send a MIME message once, even if the request has to be retried.
+
+    A unique Message-ID is stamped on the message; after an ambiguous
+    failure (5xx, timeout) Gmail is searched for it before sending again.
     """
-    Send an email via Gmail API, optionally including a file attachment.
+    if "Message-ID" not in message:
+        message["Message-ID"] = _new_message_id(service)
+    body = {"raw": urlsafe_b64encode(message.as_bytes()).decode()}
+    if thread_id:
+        body["threadId"] = thread_id
+
+    return execute(
+        service.users().messages().send(userId="me", body=body),
+        idempotent=False,
+        already_done=lambda: _find_sent(service, message["Message-ID"]),
+    )
+
+
+# Attachments at least this large (in total) are sent as a resumable media
+# upload with the MIME message streamed to disk, instead of built in memory.
+RESUMABLE_UPLOAD_THRESHOLD = int(os.getenv("GMAIL_RESUMABLE_UPLOAD_THRESHOLD", str(4 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("GMAIL_UPLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))
+
+
+def _send_large(service, headers: dict, body: str, attachment_paths: list[str], thread_id: str | None = None) -> dict:
+    """Send a message with large attachments through a resumable message/rfc822 upload."""
+    message_id_header = _new_message_id(service)
+    with tempfile.TemporaryFile() as fh:
+        write_streaming_message(fh, {**headers, "Message-ID": message_id_header}, body, attachment_paths)
+        fh.seek(0)
+        media = MediaIoBaseUpload(fh, mimetype="message/rfc822", chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        request = service.users().messages().send(
+            userId="me",
+            body={"threadId": thread_id} if thread_id else {},
+            media_body=media,
+        )
+        return execute(
+            request,
+            idempotent=False,
+            already_done=lambda: _find_sent(service, message_id_header),
+        )
+
+
+def _attachment_list(attachment_path: str | None, attachment_paths: list[str] | None) -> list[str]:
+    paths = list(attachment_paths or [])
+    if attachment_path:
+        paths.insert(0, attachment_path)
+    return paths
+
+
+def _is_large(attachment_paths: list[str]) -> bool:
+    return sum(os.path.getsize(p) for p in attachment_paths) >= RESUMABLE_UPLOAD_THRESHOLD
+
+
+def _compose_and_send(service, headers: dict, body: str, attachment_paths: list[str], thread_id: str | None = None) -> dict:
+    if attachment_paths and _is_large(attachment_paths):
+        return _send_large(service, headers, body, attachment_paths, thread_id=thread_id)
+    return _send_raw(service, build_message(headers, body, attachment_paths), thread_id=thread_id)
+
+
+def send_email(to: str, subject: str, body: str, attachment_path: str = None, attachment_paths: list[str] = None) -> dict:
+    """
+    Send an email via Gmail API, optionally including file attachments.
 
     Args:
         to (str): Recipient email address.
         subject (str): Subject of the email.
         body (str): Text body of the email.
         attachment_path (str, optional): Local filesystem path to a file to attach.
+        attachment_paths (list[str], optional): More local files to attach.
 
     Returns:
         dict: {
@@ -112,40 +764,14 @@ def send_email(to: str, subject: str, body: str, attachment_path: str = None) ->
     """
     try:
         service = get_gmail_service()
+        paths = _attachment_list(attachment_path, attachment_paths)
 
-        # MIME Multipart container
-        message = MIMEMultipart()
-        message["to"] = to
-        message["subject"] = subject
-
-        # Add body text
-        message.attach(MIMEText(body, "plain"))
-
-        # ✅ Optional attachment
-        attached = False
-        if attachment_path:
-            with open(attachment_path, "rb") as f:
-                attachment = MIMEApplication(f.read())
-                attachment.add_header(
-                    "Content-Disposition",
-                    "attachment",
-                    filename=os.path.basename(attachment_path),
-                )
-                message.attach(attachment)
-                attached = True
-
-        # Encode message for Gmail
-        raw = urlsafe_b64encode(message.as_bytes()).decode()
-
-        sent = service.users().messages().send(
-            userId="me",
-            body={"raw": raw}
-        ).execute()
+        sent = _compose_and_send(service, {"To": to, "Subject": subject}, body, paths)
 
         return {
             "status": "success",
             "message_id": sent["id"],
-            "attached": attached,
+            "attached": bool(paths),
             "to": to,
             "subject": subject
         }
@@ -154,11 +780,7 @@ def send_email(to: str, subject: str, body: str, attachment_path: str = None) ->
         return {"status": "error", "error": str(error)}
     
 #reply email
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-
-def reply_to_email(thread_id: str,in_reply_to: str,to: str,subject: str,body: str,attachment_path: str = None) -> dict:
+def reply_to_email(thread_id: str,in_reply_to: str,to: str,subject: str,body: str,attachment_path: str = None,attachment_paths: list[str] = None) -> dict:
     """
     Reply to an existing Gmail thread. Supports attachments.
 
@@ -169,6 +791,7 @@ def reply_to_email(thread_id: str,in_reply_to: str,to: str,subject: str,body: st
         subject (str): Subject line (usually "Re: ...").
         body (str): Reply text.
         attachment_path (str, optional): Local file path to attach.
+        attachment_paths (list[str], optional): More local files to attach.
 
     Returns:
         dict: {
@@ -180,48 +803,146 @@ def reply_to_email(thread_id: str,in_reply_to: str,to: str,subject: str,body: st
     """
     try:
         service = get_gmail_service()
-
-        # Multipart container
-        message = MIMEMultipart()
-        message["to"] = to
-        message["subject"] = subject
+        paths = _attachment_list(attachment_path, attachment_paths)
 
         # Gmail threading headers
-        message["In-Reply-To"] = in_reply_to
-        message["References"] = in_reply_to
-
-        # Body
-        message.attach(MIMEText(body, "plain"))
-
-        attached = False
-        if attachment_path:
-            with open(attachment_path, "rb") as f:
-                attachment = MIMEApplication(f.read())
-                attachment.add_header(
-                    "Content-Disposition",
-                    "attachment",
-                    filename=os.path.basename(attachment_path),
-                )
-                message.attach(attachment)
-                attached = True
-
-        # Encode
-        raw = urlsafe_b64encode(message.as_bytes()).decode()
-
-        sent = service.users().messages().send(
-            userId="me",
-            body={"raw": raw, "threadId": thread_id}
-        ).execute()
+        headers = {"To": to, "Subject": subject, "In-Reply-To": in_reply_to, "References": in_reply_to}
+        sent = _compose_and_send(service, headers, body, paths, thread_id=thread_id)
 
         return {
             "status": "success",
             "message_id": sent["id"],
-            "thread_id": sent["threadId"],
-            "attached": attached
+            "thread_id": sent.get("threadId", thread_id),
+            "attached": bool(paths)
         }
 
     except HttpError as error:
         return {"status": "error", "error": str(error)}
+
+# A send costs 100 quota units, so a batch of more than a couple of sends
+# overdraws the per-user rate limit and comes back as 429s. Default to as
+# many sends per batch as the quota refills per second.
+SEND_BATCH_SIZE = int(os.getenv(
+    "GMAIL_SEND_BATCH_SIZE",
+    str(max(1, int(GMAIL_UNITS_PER_SECOND // cost_of("gmail.users.messages.send")))),
+))
+# Upper bound on the encoded messages carried by one batch request
+SEND_BATCH_MAX_BYTES = int(os.getenv("GMAIL_SEND_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+def _send_chunks(request_ids: list[str], raws: dict[str, str]) -> list[list[str]]:
+    """Split sends into batches of at most SEND_BATCH_SIZE parts and SEND_BATCH_MAX_BYTES."""
+    chunks: list[list[str]] = []
+    current: list[str] = []
+    size = 0
+    for request_id in request_ids:
+        length = len(raws[request_id])
+        if current and (len(current) >= SEND_BATCH_SIZE or size + length > SEND_BATCH_MAX_BYTES):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(request_id)
+        size += length
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+#bulk send
+def send_emails(messages: list[dict], attachment_path: str = None, attachment_paths: list[str] = None) -> dict:
+    """
+    Send the same attachment(s) to many recipients in one go.
+
+    Each message is composed against the shared attachment cache, so the
+    files are read and encoded once. The messages are then sent through
+    Gmail batch requests sized to the send quota. Sends that fail with a
+    retryable error, on their own or because the whole batch failed, are
+    checked by Message-ID and re-sent at most MAX_ATTEMPTS times.
+
+    Args:
+        messages (list[dict]): [{"to": str, "subject": str, "body": str}, ...]
+        attachment_path (str, optional): Local file attached to every message.
+        attachment_paths (list[str], optional): More local files attached to every message.
+
+    Returns:
+        dict: {"results": [{"to", "status", "message_id" | "error"}, ...]}
+    """
+    service = get_gmail_service()
+    paths = _attachment_list(attachment_path, attachment_paths)
+    results: list[dict | None] = [None] * len(messages)
+
+    # Large attachments can't go through the batch endpoint; send them one by one
+    if paths and _is_large(paths):
+        for i, spec in enumerate(messages):
+            try:
+                sent = _send_large(service, {"To": spec["to"], "Subject": spec["subject"]}, spec["body"], paths)
+                results[i] = {"to": spec["to"], "status": "success", "message_id": sent["id"]}
+            except HttpError as error:
+                results[i] = {"to": spec["to"], "status": "error", "error": str(error)}
+        return {"results": results}
+
+    composed = {}
+    raws = {}
+    for i, spec in enumerate(messages):
+        message = build_message({"To": spec["to"], "Subject": spec["subject"]}, spec["body"], paths)
+        message["Message-ID"] = _new_message_id(service)
+        composed[str(i)] = message
+        raws[str(i)] = urlsafe_b64encode(message.as_bytes()).decode()
+
+    retry: list[str] = []
+    last_error: dict[str, Exception] = {}
+
+    def _on_sent(request_id, response, exception):
+        to = messages[int(request_id)]["to"]
+        if exception is None:
+            results[int(request_id)] = {"to": to, "status": "success", "message_id": response["id"]}
+        elif is_retryable(exception):
+            retry.append(request_id)
+            last_error[request_id] = exception
+        else:
+            results[int(request_id)] = {"to": to, "status": "error", "error": str(exception)}
+
+    pending = list(composed)
+    for attempt in range(MAX_ATTEMPTS):
+        for chunk in _send_chunks(pending, raws):
+            batch = service.new_batch_http_request(callback=_on_sent)
+            for request_id in chunk:
+                batch.add(service.users().messages().send(userId="me", body={"raw": raws[request_id]}), request_id=request_id)
+            try:
+                # Not idempotent: an ambiguous batch failure raises here instead
+                # of resending every part; the parts are checked one by one below.
+                execute(batch, cost=len(chunk) * cost_of("gmail.users.messages.send"), idempotent=False)
+            except Exception as error:
+                if not (is_retryable(error) or isinstance(error, HttpError)):
+                    raise
+                for request_id in chunk:
+                    if results[int(request_id)] is not None or request_id in retry:
+                        continue
+                    if is_retryable(error):
+                        retry.append(request_id)
+                        last_error[request_id] = error
+                    else:
+                        results[int(request_id)] = {"to": messages[int(request_id)]["to"], "status": "error", "error": str(error)}
+
+        if not retry:
+            break
+        # Drop the ones that actually went out despite the error
+        candidates, retry = retry, []
+        pending = []
+        for request_id in candidates:
+            found = _find_sent(service, composed[request_id]["Message-ID"])
+            if found is not None:
+                results[int(request_id)] = {"to": messages[int(request_id)]["to"], "status": "success", "message_id": found["id"]}
+            else:
+                pending.append(request_id)
+        if not pending:
+            break
+        if attempt < MAX_ATTEMPTS - 1:
+            time.sleep(backoff_delay(attempt, last_error.get(pending[0])))
+    else:
+        for request_id in pending:
+            results[int(request_id)] = {"to": messages[int(request_id)]["to"], "status": "error", "error": str(last_error[request_id])}
+
+    return {"results": results}
     
 #notify email code
 
@@ -231,18 +952,17 @@ def register_gmail_watch():
     Register Gmail watch to receive push notifications when new emails arrive.
     This creates a channel from Gmail → Pub/Sub topic.
     """
-    creds = get_credentials()
-    service = build('gmail', 'v1', credentials=creds)
+    service = get_gmail_service()
 
     request_body = {
         "labelIds": ["INBOX"],
         "topicName": os.getenv("PUBSUB_TOPIC_NAME")
     }
 
-    response = service.users().watch(
+    response = execute(service.users().watch(
         userId='me',
         body=request_body
-    ).execute()
+    ))
 
     print("✅ Gmail watch successfully registered!")
     print(f"Expiration: {response.get('expiration')}")
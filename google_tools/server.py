@@ -1,41 +1,306 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
 from fastmcp import FastMCP
-from gmail.tools import list_labels, read_latest_email,send_email,reply_to_email
-from gdrive.tools import list_drive_files,read_drive_file,download_drive_file
+from fastmcp.exceptions import ToolError
+from fastmcp.server.middleware import Middleware, MiddlewareContext
+from auth.auth import get_cache_stats
+from gmail.compose import attachment_cache
+from gdrive.tools import extraction_cache, table_cache, get_content_index
+from utils import metrics
+from utils.retry import get_executor_stats
+from gmail.tools import list_labels, read_latest_email,read_email,read_emails,list_emails,read_thread,THREAD_FULL_BODIES,send_email,send_emails,reply_to_email
+from gdrive.tools import list_drive_files,search_drive_files,search_drive_content,read_drive_file,download_drive_file,READ_MAX_CHARS
 
 app = FastMCP("gmail-mcp-server")
 
+# The Gmail/Drive client libraries are blocking, so every tool runs on this
+# bounded pool. Independent tool calls from one agent turn then run
+# concurrently instead of queueing behind the slowest one.
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "60"))
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="mcp-tool")
+# Tools that send mail run without the timeout: a ToolError while the worker
+# keeps sending would make the model retry and deliver the mail twice.
+NO_TIMEOUT_TOOLS = frozenset({send_email, reply_to_email, send_emails})
+
+# Metrics export for this process (see utils/metrics.py); off unless set
+MCP_METRICS_PORT = int(os.getenv("MCP_METRICS_PORT", "0"))
+_tool_calls = metrics.counter("mcp_tool_calls_total", "MCP tool calls by outcome (ok, error, timeout)")
+_tool_seconds = metrics.histogram("mcp_tool_seconds", "Time a tool function ran on the worker pool")
+_tool_queue_seconds = metrics.histogram("mcp_tool_queue_seconds", "Time a tool call waited for a free worker")
+metrics.register_collector("google_auth_cache", get_cache_stats)
+metrics.register_collector("google_api_executor", get_executor_stats)
+metrics.register_collector("gmail_attachment_cache", attachment_cache.stats)
+metrics.register_collector("drive_extraction_cache", extraction_cache.stats)
+metrics.register_collector("drive_table_cache", table_cache.stats)
+metrics.register_collector("drive_content_index", lambda: get_content_index().stats())
+
+
+class CorrelationMiddleware(Middleware):
+    """
+    Run each tool call under the correlation ID the agent sent along with
+    it (metrics.CORRELATION_ARG), so its logs match the email's. The
+    argument is removed before the tool's arguments are validated.
+    """
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        arguments = context.message.arguments or {}
+        correlation_id = arguments.pop(metrics.CORRELATION_ARG, None)
+        with metrics.correlation(correlation_id) if correlation_id else nullcontext():
+            return await call_next(context)
+
+
+app.add_middleware(CorrelationMiddleware())
+
+async def run_blocking(func, /, *args, **kwargs):
+    """
+    Run a blocking tool function on the tool pool with a timeout.
+
+    On timeout the caller gets a ToolError right away; the worker thread
+    finishes its current Google API call in the background. Functions in
+    NO_TIMEOUT_TOOLS are always waited for, so a send is only reported
+    once its outcome is known.
+
+    Every call is counted by outcome, its queue wait and run time go into
+    histograms, and one "tool_call" JSON log line is written. The function
+    runs in a copy of the caller's context, so logs from the worker thread
+    keep the call's correlation ID.
+    """
+    loop = asyncio.get_running_loop()
+    tool = func.__name__
+    submitted = time.perf_counter()
+    timing = {}
+
+    def _timed():
+        started = time.perf_counter()
+        _tool_queue_seconds.observe(started - submitted, tool=tool)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timing["run"] = time.perf_counter() - started
+            _tool_seconds.observe(timing["run"], tool=tool)
+
+    # run_in_executor does not carry contextvars over to the worker thread
+    future = loop.run_in_executor(_tool_executor, contextvars.copy_context().run, _timed)
+    timeout = None if func in NO_TIMEOUT_TOOLS else TOOL_TIMEOUT_SECONDS
+    outcome, error = "ok", None
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError:
+        outcome = error = "timeout"
+        raise ToolError(f"{tool} timed out after {TOOL_TIMEOUT_SECONDS:.0f}s")
+    except Exception as e:
+        outcome, error = "error", str(e)
+        raise
+    finally:
+        _tool_calls.inc(tool=tool, outcome=outcome)
+        metrics.log_event(
+            "tool_call", tool=tool, outcome=outcome, error=error,
+            seconds=round(time.perf_counter() - submitted, 4), run_seconds=timing.get("run"),
+        )
+
 # Wrap your imported functions with @app.tool()
 @app.tool()
-def list_labels_tool() -> list[str]:
+async def list_labels_tool() -> list[str]:
     """List all Gmail labels"""
-    return list_labels()
+    return await run_blocking(list_labels)
+
+@app.tool()
+async def read_latest_email_tool(token_budget: int | None = None) -> dict:
+    """
+    Read the latest email.
+
+    Quoted replies, forwarded history and signatures are stripped from the
+    body, which is then trimmed to about `token_budget` tokens.
+
+    Args:
+        token_budget: Approximate token limit for the body (default
+            GMAIL_BODY_TOKEN_BUDGET). Raise it only if the body was truncated
+            and the rest is needed.
+
+    Returns:
+        dict with subject, from, body, thread_id, message_id_header and
+        body_stats (original_chars, trimmed_chars, history_removed, truncated).
+    """
+    return await run_blocking(read_latest_email, token_budget=token_budget)
+
+@app.tool()
+async def read_email_tool(message_id: str, token_budget: int | None = None) -> dict:
+    """
+    Read one email by its Gmail message ID.
+
+    Args:
+        message_id: Gmail message ID (not the Message-ID header).
+        token_budget: Approximate token limit for the body (see read_latest_email_tool).
+
+    Returns:
+        Same fields as read_latest_email_tool: subject, from, body,
+        thread_id, message_id_header and body_stats.
+    """
+    return await run_blocking(read_email, message_id=message_id, token_budget=token_budget)
+
+@app.tool()
+async def list_emails_tool(query: str = "in:inbox", page_token: str | None = None, max_results: int = 25) -> dict:
+    """
+    List emails matching a Gmail search query with only sender, subject,
+    date and snippet. Much cheaper than read_emails_tool; use it to scan
+    or triage, then read the interesting ones with read_email_tool or
+    read_thread_tool.
+
+    Args:
+        query: Gmail search query, e.g. 'is:unread in:inbox'.
+        page_token: next_page_token from the previous call.
+        max_results: Emails per page (max 100).
+
+    Returns:
+        dict: {"emails": [{id, thread_id, from, subject, date, snippet, unread}],
+               "next_page_token": str | None, "errors": [...]}
+    """
+    return await run_blocking(list_emails, query=query, page_token=page_token, max_results=max_results)
+
+@app.tool()
+async def read_emails_tool(query: str = "in:inbox -label:sent", max_results: int = 20) -> dict:
+    """
+    Read several emails at once (useful for triaging a backlog).
+
+    Messages are fetched with Gmail batch requests, so reading 50 emails
+    costs about as much as reading one.
+
+    Args:
+        query: Gmail search query, e.g. 'is:unread in:inbox' or 'from:alice@example.com'.
+        max_results: Maximum number of emails to return.
+
+    Returns:
+        dict: {"emails": [...], "errors": [...]}. Each email has id, thread_id,
+        subject, from, date, snippet, a shortened body without quoted history,
+        message_id_header, original_chars and trimmed_chars.
+        Messages that could not be fetched are listed under "errors".
+    """
+    return await run_blocking(read_emails, query=query, max_results=max_results)
 
 @app.tool()
-def read_latest_email_tool() -> dict:
-    """Read the latest email"""
-    return read_latest_email()
+async def read_thread_tool(thread_id: str, full_bodies: int = THREAD_FULL_BODIES,
+                           message_ids: list[str] | None = None, token_budget: int | None = None) -> dict:
+    """
+    Read a whole email conversation in one call, oldest message first.
+
+    Use this instead of reading the messages of a thread one by one. Only
+    the newest `full_bodies` messages include their body; older ones show a
+    snippet. Quoted text, signatures and paragraphs repeated from earlier
+    messages are removed.
+
+    Args:
+        thread_id: Gmail thread ID (e.g. from read_latest_email_tool).
+        full_bodies: How many of the newest messages to show in full.
+        message_ids: Also show these messages (Gmail message IDs) in full.
+        token_budget: Approximate token limit shared by all bodies.
+
+    Returns:
+        dict with thread_id, subject, message_count, participants, messages
+        (id, from, date, message_id_header and body or snippet) and
+        reply_to: the thread_id/message_id_header/from/subject to pass to
+        reply_email_tool.
+    """
+    return await run_blocking(read_thread, thread_id=thread_id, full_bodies=full_bodies,
+                              message_ids=message_ids, token_budget=token_budget)
+
+@app.tool()
+async def list_drive_files_tool(query: str | None = None, order_by: str = "modifiedTime desc",
+                          page_size: int = 10, page_token: str | None = None) -> dict:
+    """
+    List Google Drive files, one page at a time.
+
+    Args:
+        query: Optional Drive filter, e.g. "mimeType='application/pdf'" or
+            "name contains 'resume'".
+        order_by: Sort order, e.g. "modifiedTime desc" (default) or "name".
+        page_size: Files per page (max 100).
+        page_token: Pass next_page_token from the previous call to get the next page.
+
+    Returns:
+        dict: {"files": [{name, id, type, modified}], "next_page_token": str | None}
+    """
+    return await run_blocking(list_drive_files, query=query, order_by=order_by, page_size=page_size, page_token=page_token)
+
+@app.tool()
+async def search_drive_files_tool(text: str, mime_type: str | None = None,
+                            page_size: int = 10, page_token: str | None = None) -> dict:
+    """
+    Find Google Drive files whose name or content contains `text`.
+
+    Prefer this over paging through list_drive_files_tool when looking
+    for a specific document.
+
+    Args:
+        text: Words to search for.
+        mime_type: Optional MIME type filter, e.g. 'application/pdf'.
+        page_size: Files per page (max 100).
+        page_token: next_page_token from the previous call.
+
+    Returns:
+        dict: {"files": [{name, id, type, modified}], "next_page_token": str | None}
+    """
+    return await run_blocking(search_drive_files, text=text, mime_type=mime_type, page_size=page_size, page_token=page_token)
 
 @app.tool()
-def list_drive_files_tool() -> dict:
-    """List drive file"""
-    return list_drive_files()
+async def search_drive_content_tool(query: str, k: int = 5) -> dict:
+    """
+    Search inside Drive documents (Docs, Sheets, PDFs, text files) using a
+    local full-text index, and return the best-matching passages.
+
+    Use this to find where something is mentioned before reading any file;
+    then read only the matching part with read_drive_file_tool (a PDF
+    "page N" location maps to start_page=N, a sheet "rows A-B" location to
+    offset=A).
+
+    Args:
+        query: Words to look for.
+        k: Maximum number of passages to return (max 50).
+
+    Returns:
+        dict: {"results": [{file_id, name, location, score, snippet}],
+               "indexed_documents": int, "pending": int, "indexing": bool,
+               "errors": [...]}.
+        "pending" counts changed files not indexed yet. They are indexed
+        in the background ("indexing" is true meanwhile) and found by
+        later searches.
+    """
+    return await run_blocking(search_drive_content, query=query, k=k)
 
 @app.tool()
-def read_drive_file_tool(file_id: str) -> dict:
+async def read_drive_file_tool(file_id: str, start_page: int = 1, end_page: int | None = None, max_chars: int = READ_MAX_CHARS,
+                               offset: int = 0, limit: int | None = None, columns: list[str] | None = None) -> dict:
     """
     Read file contents from Google Drive by file ID.
     
     Args:
         file_id: The Google Drive file ID (example: '1ZvqzwwJBUSgKsfRn4xdog_9ueA05SNRL')
+        start_page: For PDFs, first page to read (1-based).
+        end_page: For PDFs, last page to read (inclusive). Defaults to the last page.
+        max_chars: Maximum characters of content to return; longer content is cut off.
+        offset: For Google Sheets and CSV files, first data row to return (0-based).
+        limit: For Sheets/CSV, number of rows to return (default 100).
+        columns: For Sheets/CSV, only return these columns (header names).
     
     Returns:
-        Dictionary with file name, type, and content
+        Dictionary with file name, type, content and a "truncated" flag.
+        PDFs also report total_pages and the pages_read range, so you can
+        continue with a later start_page if needed.
+        Sheets/CSV instead return "schema" (columns with inferred types and
+        row_count), "columns", "rows" and "next_offset" for the next page.
+        Use limit=0 to get just the schema.
     """
-    return read_drive_file(file_id=file_id)
+    return await run_blocking(read_drive_file, file_id=file_id, start_page=start_page, end_page=end_page, max_chars=max_chars,
+                              offset=offset, limit=limit, columns=columns)
 
 #send email tool
 @app.tool()
-def send_email_tool(to: str, subject: str, body: str,attachment_path: str = None) -> dict:
+async def send_email_tool(to: str, subject: str, body: str,attachment_path: str = None,attachment_paths: list[str] = None) -> dict:
     """
     Send an email using the Gmail API, optionally including a file attachment.
 
@@ -56,6 +321,8 @@ def send_email_tool(to: str, subject: str, body: str,attachment_path: str = None
             Local filesystem path to a file to attach. Must point to a valid,
             previously downloaded file (e.g., saved in the 'attachments/' folder).
             If None, the email is sent without an attachment.
+        attachment_paths (list[str] | None, optional):
+            Additional local files to attach.
 
     Returns:
         dict: {
@@ -66,26 +333,48 @@ def send_email_tool(to: str, subject: str, body: str,attachment_path: str = None
             "subject": str         # Subject line
         }
     """
-    return send_email(to=to,subject=subject,body=body,attachment_path=attachment_path)
+    return await run_blocking(send_email, to=to,subject=subject,body=body,attachment_path=attachment_path,attachment_paths=attachment_paths)
+
+#bulk send tool
+@app.tool()
+async def send_emails_tool(messages: list[dict], attachment_path: str = None, attachment_paths: list[str] = None) -> dict:
+    """
+    Send individual emails to many recipients that share the same attachment(s).
+
+    Use this instead of calling send_email_tool repeatedly, e.g. when sending
+    a resume to several people: the attachment is encoded once and the
+    emails go out in Gmail batch requests.
+
+    Args:
+        messages: List of {"to": str, "subject": str, "body": str}, one per email.
+        attachment_path: Local file (from download_drive_file_tool) attached to every email.
+        attachment_paths: Additional local files attached to every email.
+
+    Returns:
+        dict: {"results": [{"to", "status", "message_id" | "error"}, ...]} in input order.
+    """
+    return await run_blocking(send_emails, messages=messages, attachment_path=attachment_path, attachment_paths=attachment_paths)
 
 
 #download file content from drive
 @app.tool()
-def download_drive_file_tool(file_id: str, filename: str) -> dict:
+async def download_drive_file_tool(file_id: str, filename: str) -> dict:
     """
     Download a Google Drive file locally for attachment use.
 
     This tool retrieves a file from Google Drive by its file ID and stores it
-    in the local "attachments/" directory. If the file already exists locally,
-    it will NOT be downloaded again, allowing reuse across multiple email sends
-    without impacting Google Drive quota or passing large binary data through
-    the LLM context.
+    in the local "attachments/" directory. If the same revision of the file
+    already exists locally, it will NOT be downloaded again, allowing reuse
+    across multiple email sends without impacting Google Drive quota or
+    passing large binary data through the LLM context.
+
+    Always pass the returned "path" to send_email_tool/reply_email_tool.
     """
-    return download_drive_file(file_id=file_id,filename=filename)
+    return await run_blocking(download_drive_file, file_id=file_id,filename=filename)
 
 #reply email
 @app.tool()
-def reply_email_tool(thread_id: str,in_reply_to: str,to: str,subject: str,body: str,attachment_path: str = None) -> dict:
+async def reply_email_tool(thread_id: str,in_reply_to: str,to: str,subject: str,body: str,attachment_path: str = None,attachment_paths: list[str] = None) -> dict:
     """
     Reply to an existing Gmail thread. Supports attachments.
 
@@ -101,12 +390,14 @@ def reply_email_tool(thread_id: str,in_reply_to: str,to: str,subject: str,body:
         subject (str): Subject line, e.g., "Re: Job Application".
         body (str): Reply body text.
         attachment_path (str, optional): Local file path to attach.
+        attachment_paths (list[str], optional): Additional local files to attach.
 
     Returns:
         dict with status, message_id, thread_id, and attached status.
     """
-    return reply_to_email(thread_id=thread_id,in_reply_to=in_reply_to,to=to,subject=subject,body=body,attachment_path=attachment_path)
+    return await run_blocking(reply_to_email, thread_id=thread_id,in_reply_to=in_reply_to,to=to,subject=subject,body=body,attachment_path=attachment_path,attachment_paths=attachment_paths)
 
 
 if __name__ == "__main__":
+    metrics.start_exporter("mcp_tools", MCP_METRICS_PORT)
     app.run()
\ No newline at end of file
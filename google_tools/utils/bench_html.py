@@ -0,0 +1,75 @@
+"""
+Micro-benchmark for the HTML → text conversion used on email bodies.
+
+Usage (from google_tools/):
+    python -m utils.bench_html [CORPUS_DIR] [--repeat N]
+
+CORPUS_DIR should contain real HTML emails as *.html / *.htm files (e.g.
+saved with "Show original" in Gmail). Without it a synthetic
+newsletter-style message is used. For each file the old regex stripper and
+html_to_text are timed, along with how much text each hands to the LLM.
+"""
+import argparse
+import html
+import re
+import sys
+import time
+from pathlib import Path
+
+from utils.util import html_to_text
+
+
+def legacy_strip_html_tags(html_text):
+    """The previous implementation, kept here for comparison."""
+    text = re.sub(r'<[^>]+>', '', html_text)
+    text = html.unescape(text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def synthetic_newsletter(items: int = 60) -> str:
+    style = "<style>" + "".join(f".c{i}{{color:#{i:06x};padding:{i}px}}" for i in range(400)) + "</style>"
+    script = "<script>" + "var tracking = {};" * 300 + "</script>"
+    rows = "".join(
+        f'<tr><td class="c{i}"><h2>Story {i}</h2><p>Lorem ipsum dolor sit amet &amp; more text '
+        f'for item {i}.</p><a href="https://example.com/story/{i}?utm_source=news">Read more</a></td></tr>'
+        for i in range(items)
+    )
+    return f"<html><head><title>News</title>{style}</head><body>{script}<table>{rows}</table></body></html>"
+
+
+def bench(func, text: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("corpus", nargs="?", help="directory of .html/.htm emails")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        files = sorted(p for p in Path(args.corpus).iterdir() if p.suffix.lower() in (".html", ".htm"))
+        corpus = [(p.name, p.read_text(encoding="utf-8", errors="ignore")) for p in files]
+    else:
+        corpus = [("synthetic-newsletter", synthetic_newsletter())]
+    if not corpus:
+        sys.exit("No .html/.htm files found")
+
+    print(f"{'file':32} {'bytes':>9} {'legacy ms':>10} {'new ms':>8} {'legacy chars':>13} {'new chars':>10}")
+    totals = [0.0, 0.0, 0, 0]
+    for name, text in corpus:
+        legacy_ms = bench(legacy_strip_html_tags, text, args.repeat) * 1000
+        new_ms = bench(lambda t: html_to_text(t), text, args.repeat) * 1000
+        legacy_chars = len(legacy_strip_html_tags(text))
+        new_chars = len(html_to_text(text)[0])
+        totals = [totals[0] + legacy_ms, totals[1] + new_ms, totals[2] + legacy_chars, totals[3] + new_chars]
+        print(f"{name[:32]:32} {len(text):>9} {legacy_ms:>10.3f} {new_ms:>8.3f} {legacy_chars:>13} {new_chars:>10}")
+    print(f"{'TOTAL':32} {'':>9} {totals[0]:>10.3f} {totals[1]:>8.3f} {totals[2]:>13} {totals[3]:>10}")
+
+
+if __name__ == "__main__":
+    main()
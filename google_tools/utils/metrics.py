@@ -0,0 +1,302 @@
+"""
+Process-local metrics and structured JSON logs.
+
+Counters and histograms are kept in memory and rendered in the Prometheus
+text exposition format, either served over HTTP (`/metrics`) or written
+periodically to `<METRICS_DIR>/<job>.prom` for node_exporter's textfile
+collector. Existing stats() / get_*_stats() snapshots are exported as
+gauges through register_collector(), so caches keep their own counters.
+
+log_event() writes one JSON object per line, tagged with the correlation
+ID of the email being processed (see correlation()). The agent passes the
+ID to the MCP tool server as the CORRELATION_ARG tool argument, so tool
+and Google API logs of one email carry it too. Logs go to
+METRICS_LOG_PATH or stderr, never stdout, which carries the MCP protocol
+in the tool server.
+
+This module only depends on the standard library so it can be imported
+by the MCP tool server, the agent and email_listner.py alike.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+# Directory for textfile-exporter output (unset = don't write files)
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "15"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# JSON log destination (unset = stderr); METRICS_LOG=0 turns logs off
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH")
+METRICS_LOG_ENABLED = os.getenv("METRICS_LOG", "1") != "0"
+
+# Seconds; spans fast cache hits up to slow LLM runs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    def __init__(self, name: str, doc: str):
+        self.name = name
+        self.doc = doc
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels (seconds unless noted)."""
+
+    def __init__(self, name: str, doc: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count], sum
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the `with` block, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total[0])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """All metrics of one process, plus collectors polled at export time."""
+
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._collectors: list[tuple[str, Callable[[], dict]]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+    def counter(self, name: str, doc: str) -> Counter:
+        return self._get_or_create(Counter, name, doc)
+
+    def histogram(self, name: str, doc: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, doc, buckets)
+
+    def register_collector(self, prefix: str, stats: Callable[[], dict]) -> None:
+        """Export the numeric values of `stats()` as gauges named `<prefix>_<key>`."""
+        with self._lock:
+            self._collectors = [c for c in self._collectors if c[0] != prefix] + [(prefix, stats)]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, stats in collectors:
+            try:
+                values = stats()
+            except Exception as e:
+                log_event("metrics_collector_error", collector=prefix, error=str(e))
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+render = REGISTRY.render
+
+
+# ---------- structured logs ----------
+
+_correlation_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("correlation_id", default=None)
+# Extra tool-call argument carrying the correlation ID from the agent to the
+# MCP tool server, which removes it before the tool sees its arguments
+CORRELATION_ARG = "_correlation_id"
+_log_lock = threading.Lock()
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_correlation_id() -> Optional[str]:
+    return _correlation_id.get()
+
+
+@contextmanager
+def correlation(correlation_id: Optional[str] = None):
+    """Tag every log_event() in this context (and tasks it starts) with one ID."""
+    token = _correlation_id.set(correlation_id or new_correlation_id())
+    try:
+        yield _correlation_id.get()
+    finally:
+        _correlation_id.reset(token)
+
+
+def log_event(event: str, **fields) -> None:
+    """Write one JSON log line: timestamp, event, correlation_id and `fields`."""
+    if not METRICS_LOG_ENABLED:
+        return
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "event": event,
+        "correlation_id": _correlation_id.get(),
+        **fields,
+    }
+    line = json.dumps(record, default=str) + "\n"
+    with _log_lock:
+        if METRICS_LOG_PATH:
+            with open(METRICS_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line)
+        else:
+            sys.stderr.write(line)
+            sys.stderr.flush()
+
+
+# ---------- exporters ----------
+
+_exporter_lock = threading.Lock()
+_exporters_started: set[str] = set()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of stderr
+        pass
+
+
+def write_textfile(path: str) -> None:
+    """Write the current metrics to `path` atomically."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(render())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _textfile_loop(path: str) -> None:
+    while True:
+        time.sleep(METRICS_EXPORT_INTERVAL)
+        try:
+            write_textfile(path)
+        except OSError as e:
+            log_event("metrics_export_error", path=path, error=str(e))
+
+
+def start_exporter(job: str, port: Optional[int] = None) -> None:
+    """
+    Start exporting this process's metrics (idempotent per job).
+
+    Serves http://METRICS_HOST:<port>/metrics when `port` is given, and
+    writes <METRICS_DIR>/<job>.prom every METRICS_EXPORT_INTERVAL seconds
+    when METRICS_DIR is set.
+    """
+    with _exporter_lock:
+        if job in _exporters_started:
+            return
+        _exporters_started.add(job)
+
+    if port:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+        except OSError as e:
+            log_event("metrics_export_error", job=job, port=port, error=str(e))
+        else:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"metrics-{job}", daemon=True).start()
+            log_event("metrics_exporter_started", job=job, port=port)
+
+    if METRICS_DIR:
+        path = os.path.join(METRICS_DIR, f"{job}.prom")
+        threading.Thread(target=_textfile_loop, args=(path,), name=f"metrics-file-{job}", daemon=True).start()
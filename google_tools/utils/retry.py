@@ -0,0 +1,216 @@
+"""
+Central executor for Gmail/Drive API requests.
+
+Every tool sends its requests through execute() instead of calling
+request.execute() directly. That gives all of them:
+
+- a client-side token bucket per API, sized in Gmail quota units per
+  method, so bursts queue briefly instead of tripping per-user quota;
+- retries with jittered exponential backoff on 429, 5xx and rate-limit
+  403s, honouring Retry-After;
+- idempotency-aware retries: a non-idempotent request (messages.send) is
+  only retried blindly when the server definitely rejected it; after an
+  ambiguous failure the caller's `already_done` check runs first.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+from googleapiclient.errors import HttpError
+
+MAX_ATTEMPTS = int(os.getenv("GOOGLE_API_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = float(os.getenv("GOOGLE_API_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX_SECONDS = float(os.getenv("GOOGLE_API_BACKOFF_MAX", "32"))
+
+# Gmail bills each method in quota units; the per-user limit is 250 units/s.
+# https://developers.google.com/gmail/api/reference/quota
+GMAIL_QUOTA_UNITS = {
+    "gmail.users.getProfile": 1,
+    "gmail.users.labels.list": 1,
+    "gmail.users.history.list": 2,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.attachments.get": 5,
+    "gmail.users.threads.get": 10,
+    "gmail.users.threads.list": 10,
+    "gmail.users.messages.send": 100,
+    "gmail.users.watch": 100,
+}
+GMAIL_UNITS_PER_SECOND = float(os.getenv("GMAIL_UNITS_PER_SECOND", "250"))
+# Drive has no per-method units; it limits plain queries per user
+DRIVE_QUERIES_PER_SECOND = float(os.getenv("DRIVE_QUERIES_PER_SECOND", "20"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+# Network failures. The pooled transport (auth/transport.py) raises requests'
+# own exceptions, which don't subclass the builtin ConnectionError/TimeoutError.
+NETWORK_ERRORS = (
+    socket.timeout, TimeoutError, ConnectionError,
+    requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+)
+
+
+class TokenBucket:
+    """Blocking token bucket: acquire(n) waits until n tokens are available."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Take `tokens`, sleeping as needed; return the time spent waiting.
+
+        More than `capacity` tokens (e.g. a large batch) are taken in
+        capacity-sized parts, so the full cost is charged.
+        """
+        waited = 0.0
+        while tokens > 0:
+            part = min(tokens, self.capacity)
+            waited += self._take(part)
+            tokens -= part
+        return waited
+
+    def _take(self, tokens: float) -> float:
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+_buckets = {
+    "gmail": TokenBucket(GMAIL_UNITS_PER_SECOND),
+    "drive": TokenBucket(DRIVE_QUERIES_PER_SECOND),
+}
+
+_stats_lock = threading.Lock()
+_stats = {"calls": 0, "retries": 0, "throttled_seconds": 0.0, "failures": 0}
+
+
+def get_executor_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _bump(key: str, amount: float = 1) -> None:
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def cost_of(method_id: Optional[str]) -> float:
+    """Quota cost of one call to `method_id` (e.g. "gmail.users.messages.get")."""
+    if not method_id:
+        return 1
+    return GMAIL_QUOTA_UNITS.get(method_id, 5 if method_id.startswith("gmail.") else 1)
+
+
+def throttle(method_id: Optional[str], cost: Optional[float] = None) -> None:
+    """Wait for quota before calling `method_id` (or spending an explicit `cost`)."""
+    api = (method_id or "").split(".", 1)[0]
+    bucket = _buckets.get(api)
+    if bucket is None:
+        return
+    waited = bucket.acquire(cost if cost is not None else cost_of(method_id))
+    if waited:
+        _bump("throttled_seconds", waited)
+
+
+def _error_reason(error: HttpError) -> Optional[str]:
+    try:
+        details = json.loads(error.content.decode("utf-8"))["error"]
+        return details["errors"][0].get("reason")
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status in RETRYABLE_STATUSES:
+            return True
+        return status == 403 and _error_reason(error) in RATE_LIMIT_REASONS
+    return isinstance(error, NETWORK_ERRORS)
+
+
+def _definitely_rejected(error: Exception) -> bool:
+    """
+    True if the server refused the request before acting on it (safe to resend).
+
+    Network errors are never "definitely rejected": a reset or read timeout
+    can come after the server already processed the request.
+    """
+    return isinstance(error, HttpError) and (
+        error.resp.status == 429
+        or (error.resp.status == 403 and _error_reason(error) in RATE_LIMIT_REASONS)
+    )
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After if it sent one."""
+    if isinstance(error, HttpError):
+        retry_after = error.resp.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass  # HTTP-date form; fall back to backoff
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def execute(request, *, cost: Optional[float] = None, idempotent: bool = True,
+            already_done: Optional[Callable[[], Optional[dict]]] = None):
+    """
+    Execute a googleapiclient request (or batch) with throttling and retries.
+
+    Args:
+        request: HttpRequest or BatchHttpRequest.
+        cost: Quota units to charge; defaults to the cost of request.methodId.
+            Pass it explicitly for batch requests (sum of their parts).
+        idempotent: False for requests with side effects such as messages.send.
+        already_done: For non-idempotent requests, called after an ambiguous
+            failure (5xx, timeout). If it returns a result, the request is
+            known to have succeeded and that result is returned instead of
+            sending again.
+    """
+    method_id = getattr(request, "methodId", None)
+    if method_id is None and cost is not None:
+        # Batch requests carry no methodId; charge the Gmail bucket
+        method_id = "gmail.batch"
+
+    for attempt in range(MAX_ATTEMPTS):
+        throttle(method_id, cost)
+        _bump("calls")
+        try:
+            return request.execute()
+        except Exception as error:
+            if not is_retryable(error) or attempt == MAX_ATTEMPTS - 1:
+                _bump("failures")
+                raise
+            if not idempotent and not _definitely_rejected(error):
+                # The send may have gone through; only resend if it did not
+                done = already_done() if already_done else None
+                if done is not None:
+                    return done
+                if already_done is None:
+                    _bump("failures")
+                    raise
+            _bump("retries")
+            time.sleep(backoff_delay(attempt, error))
@@ -1,11 +1,166 @@
-def strip_html_tags(html_text):
-    """Simple HTML tag stripper (use BeautifulSoup for better results)"""
-    import re
-    # Remove HTML tags
-    text = re.sub(r'<[^>]+>', '', html_text)
-    # Decode HTML entities
-    import html
-    text = html.unescape(text)
-    # Clean up whitespace
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
\ No newline at end of file
+import os
+import re
+from html import unescape
+
+# Default cap on text produced from one HTML body (0 = unlimited)
+HTML_TEXT_MAX_CHARS = int(os.getenv("HTML_TEXT_MAX_CHARS", "50000")) or None
+
+# Precompiled once; these run on every HTML email body. The whitespace
+# patterns only match where something changes (not every single space or
+# newline), which keeps their substitutions cheap.
+_INLINE_WS = re.compile(r"[ \t\r\f\v\u00a0]{2,}|[\t\r\f\v\u00a0]")
+_LINE_EDGES = re.compile(r" \n ?|\n ")
+_BLANK_LINES = re.compile(r"\n\n\n+")
+# Cut whole non-text blocks (CSS/JS/head), comments, doctypes and
+# processing instructions in one C-level pass before tokenizing. Block
+# bodies are scanned a "<" at a time rather than with a lazy .*?, which
+# would try the closing tag at every character of large <style> blocks.
+_SKIP_BLOCKS = re.compile(
+    r"<(script|style|head|noscript|template|svg)\b[^<]*+(?:<(?!/\1\s*>)[^<]*+)*+</\1\s*>"
+    r"|<!--.*?-->|<![^>]*>|<\?.*?\?>",
+    re.IGNORECASE | re.DOTALL,
+)
+# One token per match: a tag (group 1 = "/" for end tags, 2 = name, 3 = attrs)
+# or a run of text (group 4). A lone "<" that starts no tag is text too.
+# Quoted attribute values (after "=") may contain ">"; any other quote is a
+# plain character. The possessive quantifiers keep a tag that never closes
+# from backtracking.
+_TOKENS = re.compile(
+    r"""<(/?)([a-zA-Z][\w:-]*)((?:[^>"'=]++|=\s*+(?:"[^"]*+"|'[^']*+')?+|["'])*+)>|([^<]+|<)"""
+)
+_HREF = re.compile(r"""href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+
+# Elements whose contents are never body text
+_SKIP_TAGS = frozenset({"script", "style", "head", "title", "noscript", "template", "svg"})
+# Elements that start a new line / paragraph in the rendered text
+_BLOCK_TAGS = frozenset({
+    "p", "div", "section", "article", "header", "footer", "blockquote", "pre",
+    "table", "tr", "ul", "ol", "dl", "dt", "dd", "h1", "h2", "h3", "h4", "h5", "h6",
+    "hr", "form", "center",
+})
+_VOID_TAGS = frozenset({"br", "img", "hr", "meta", "link", "input", "col", "area", "base", "wbr"})
+
+
+class _TextLimitReached(Exception):
+    pass
+
+
+class _HTMLToText:
+    """
+    Streaming HTML → plain text converter that keeps paragraph and link structure.
+
+    Same handler layout as html.parser.HTMLParser, but tokenized with one
+    precompiled regex, about twice as fast as driving these handlers from
+    HTMLParser.
+
+    The gain over the old strip-all-tags regex is output size, not speed:
+    on utils/bench_html.py's newsletter the text handed to the LLM shrinks
+    to about a third (CSS, scripts and <head> are dropped), while the
+    conversion takes roughly twice as long (well under 2 ms).
+    """
+
+    def __init__(self, max_length: int | None = None):
+        self.max_length = max_length
+        self.parts: list[str] = []
+        self.length = 0
+        self.truncated = False
+        self._skip_depth = 0
+        self._links: list[tuple[str | None, int]] = []
+
+    def _emit(self, text: str) -> None:
+        if self.max_length is not None and self.length + len(text) > self.max_length:
+            self.parts.append(text[:self.max_length - self.length])
+            self.length = self.max_length
+            self.truncated = True
+            raise _TextLimitReached
+        self.parts.append(text)
+        self.length += len(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            # Ends an unclosed <head> (or anything else left open before it)
+            self._skip_depth = 0
+            return
+        if tag in _SKIP_TAGS:
+            if tag not in _VOID_TAGS:
+                self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        if tag == "br":
+            self._emit("\n")
+        elif tag == "li":
+            self._emit("\n- ")
+        elif tag in ("td", "th"):
+            self._emit(" ")
+        elif tag in _BLOCK_TAGS:
+            self._emit("\n\n")
+        elif tag == "a":
+            match = _HREF.search(attrs)
+            href = unescape(next(g for g in match.groups() if g is not None)) if match else None
+            self._links.append((href, len(self.parts)))
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            if self._skip_depth:
+                self._skip_depth -= 1
+            return
+        if self._skip_depth:
+            return
+        if tag in _BLOCK_TAGS:
+            self._emit("\n\n")
+        elif tag == "a" and self._links:
+            href, start = self._links.pop()
+            link_text = "".join(self.parts[start:]).strip()
+            # Keep real destinations; drop anchors, mailto: and bare-URL duplicates
+            if href and href.startswith(("http://", "https://")) and link_text and href not in link_text:
+                self._emit(f" ({href})")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._emit(unescape(data) if "&" in data else data)
+
+    def feed(self, html_text: str) -> None:
+        # findall() builds the tuples in C; unmatched groups come back as ""
+        for closing, tag, attrs, data in _TOKENS.findall(html_text):
+            if data:
+                self.handle_data(data)
+            elif closing:
+                self.handle_endtag(tag.lower())
+            elif attrs.endswith("/"):
+                self.handle_startendtag(tag.lower(), attrs)
+            else:
+                self.handle_starttag(tag.lower(), attrs)
+
+    def text(self) -> str:
+        text = _INLINE_WS.sub(" ", "".join(self.parts))
+        text = _LINE_EDGES.sub("\n", text)
+        return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def html_to_text(html_text: str, max_length: int | None = None) -> tuple[str, bool]:
+    """
+    Convert HTML to readable plain text.
+
+    Drops <script>, <style> and <head> content, turns block elements into
+    paragraphs, list items into "- " lines and links into "text (url)".
+    Parsing stops as soon as `max_length` characters of text were produced.
+
+    Returns (text, truncated).
+    """
+    parser = _HTMLToText(max_length)
+    try:
+        parser.feed(_SKIP_BLOCKS.sub(" ", html_text))
+    except _TextLimitReached:
+        pass
+    return parser.text(), parser.truncated
+
+
+def strip_html_tags(html_text, max_length=HTML_TEXT_MAX_CHARS):
+    """HTML → plain text for email bodies (see html_to_text)."""
+    return html_to_text(html_text, max_length)[0]